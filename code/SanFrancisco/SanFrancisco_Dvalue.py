@@ -1,9 +1,14 @@
-import folium
-from scipy.stats import gaussian_kde
 import numpy as np
-import pandas as pd
 import json
 import matplotlib.pyplot as plt
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from catchment import catchment_stats, haversine_km
+from cities import get_city
+from trip_loader import load_trips
 
 # Step 1: Load GeoJSON data for metro stations
 geojson_path = 'data/SanFrancisco/SanFrancisco_railwaystation.geojson' 
@@ -17,73 +22,33 @@ for feature in metro_data['features']:
     name = feature['properties'].get('name', 'Metro Station')
     metro_stations.append({'name': name, 'coordinates': coordinates})
 
-# Step 2: Load bike-sharing data
-file_path = 'data/SanFrancisco/202008-baywheels-tripdata.csv' 
-
-# Load bike-sharing data into a DataFrame
-bike_data = pd.read_csv(file_path)
-
-# Filter data within the bounding box
-lng_min, lng_max = -122.5233, -122.3551
-lat_min, lat_max = 37.7083, 37.8163
-
-filtered_data = bike_data[
-    (bike_data["start_lng"] >= lng_min) & (bike_data["start_lng"] <= lng_max) &
-    (bike_data["end_lng"] >= lng_min) & (bike_data["end_lng"] <= lng_max) &
-    (bike_data["end_lat"] >= lat_min) & (bike_data["end_lat"] <= lat_max)
-]
+# Step 2: Load bike-sharing data within the bounding box (cached trip table, see trip_loader.py)
+filtered_data = load_trips('SanFrancisco')
 
 # Extract start and end coordinates
 start_coords = np.vstack([filtered_data["start_lng"], filtered_data["start_lat"]])  # [lng, lat]
 end_coords = np.vstack([filtered_data["end_lng"], filtered_data["end_lat"]])     # [lng, lat]
 
-# Define function to calculate distance
-def haversine_distance(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in kilometers
-    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
-    c = 2 * np.arcsin(np.sqrt(a))
-    return R * c
-
 # Calculate distances for each trip
-distances = haversine_distance(filtered_data["start_lat"], filtered_data["start_lng"],
-                               filtered_data["end_lat"], filtered_data["end_lng"])
+distances = haversine_km(filtered_data["start_lat"], filtered_data["start_lng"],
+                         filtered_data["end_lat"], filtered_data["end_lng"])
 
 # Add distances to DataFrame
 filtered_data.loc[:, "distance_km"] = distances
 
-# Define function to check if a point is within 150 meters of a station
-def is_within_150m(lat1, lon1, lat2, lon2):
-    return haversine_distance(lat1, lon1, lat2, lon2) <= 0.15
-
-# Calculate distances for trips near each metro station
-results = []
-
-for station in metro_stations:
-    station_name = station['name']
-    station_lat, station_lng = station['coordinates'][1], station['coordinates'][0]
-    
-    # Filter trips that start or end within 150 meters of the station
-    nearby_trips = filtered_data[
-        filtered_data.apply(lambda row: is_within_150m(row["start_lat"], row["start_lng"], station_lat, station_lng) or
-                                      is_within_150m(row["end_lat"], row["end_lng"], station_lat, station_lng), axis=1)
-    ]
-    
-    # Calculate average distance and 90th percentile distance for these trips
-    avg_distance = nearby_trips["distance_km"].mean()
-    if not nearby_trips.empty:
-        percentile_90_distance = np.percentile(nearby_trips["distance_km"], 90)
-    else:
-        percentile_90_distance = np.nan
-    
-    # Append results
-    results.append({
-        'station_name': station_name,
-        'average_distance': avg_distance,
-        'percentile_90_distance': percentile_90_distance
-    })
+# Find the trips that start or end within 150 meters of each station in one batched query
+station_lng = np.array([station['coordinates'][0] for station in metro_stations])
+station_lat = np.array([station['coordinates'][1] for station in metro_stations])
+stats = catchment_stats(station_lng, station_lat,
+                        [(filtered_data["start_lng"], filtered_data["start_lat"]),
+                         (filtered_data["end_lng"], filtered_data["end_lat"])],
+                        filtered_data["distance_km"], radius_m=150, crs=get_city('SanFrancisco')['metric_crs'])
+
+# Average distance and 90th percentile distance of these trips per station
+results = [
+    {'station_name': station['name'], 'average_distance': avg_distance, 'percentile_90_distance': percentile_90_distance}
+    for station, avg_distance, percentile_90_distance in zip(metro_stations, stats['mean'], stats['p90'])
+]
 
 # Print results
 for result in results:
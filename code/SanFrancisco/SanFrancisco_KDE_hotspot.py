@@ -1,11 +1,18 @@
 import folium
-from scipy.stats import gaussian_kde
 import numpy as np
-import pandas as pd
 import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cities import get_city
+from kde import binned_kde, gaussian_kde_covariance
+from raster_overlay import add_image_overlay
+from trip_loader import load_trips
 
 # Step 1: Load GeoJSON data for metro stations
-geojson_path = 'TIL-4030-groupwork2/data/SanFrancisco/SanFrancisco_railwaystation.geojson' 
+geojson_path = 'data/SanFrancisco/SanFrancisco_railwaystation.geojson' 
 with open(geojson_path, 'r') as f:
     metro_data = json.load(f)
 
@@ -16,40 +23,27 @@ for feature in metro_data['features']:
     name = feature['properties'].get('name', 'Metro Station')
     metro_stations.append({'name': name, 'coordinates': coordinates})
 
-# Step 2: Load bike-sharing data
-file_path = 'TIL-4030-groupwork2/data/SanFrancisco/202008-baywheels-tripdata.csv' 
-
-# Load bike-sharing data into a DataFrame
-bike_data = pd.read_csv(file_path)
-
-# Filter data within the bounding box
-lng_min, lng_max = -122.5233, -122.3551
-lat_min, lat_max = 37.7083, 37.8163
-
-filtered_data = bike_data[
-    (bike_data["start_lng"] >= lng_min) & (bike_data["start_lng"] <= lng_max) &
-    (bike_data["end_lng"] >= lng_min) & (bike_data["end_lng"] <= lng_max) &
-    (bike_data["end_lat"] >= lat_min) & (bike_data["end_lat"] <= lat_max)
-]
+# Step 2: Load bike-sharing data within the bounding box (cached trip table, see trip_loader.py)
+filtered_data = load_trips('SanFrancisco')
+lng_min, lng_max, lat_min, lat_max = get_city('SanFrancisco')['trips']['bbox']
 
 # Extract start and end coordinates
-start_coords = np.vstack([filtered_data["start_lng"], filtered_data["end_lat"]])  # [lng, lat]
+start_coords = np.vstack([filtered_data["start_lng"], filtered_data["start_lat"]])  # [lng, lat]
 end_coords = np.vstack([filtered_data["end_lng"], filtered_data["end_lat"]])     # [lng, lat]
 
 # Step 3: KDE for density calculation
 # Define grid resolution and bandwidth
 lng_grid = np.linspace(lng_min, lng_max, 500)
 lat_grid = np.linspace(lat_min, lat_max, 500)
-X, Y = np.meshgrid(lng_grid, lat_grid)
-grid_coords = np.vstack([X.ravel(), Y.ravel()])
 
 # KDE for start points
-bandwidth_start = 0.03  # Adjust bandwidth value to optimize smoothing effect
-kde_start = gaussian_kde(start_coords, bw_method=bandwidth_start)(grid_coords).reshape(X.shape)
+# Kernel covariance in m^2 equal to gaussian_kde(bw_method=0.03); a scalar bandwidth in metres also works
+bandwidth_start = gaussian_kde_covariance(start_coords[0], start_coords[1], 0.03)
+kde_start = binned_kde(start_coords[0], start_coords[1], lng_grid, lat_grid, bandwidth_start)
 
 # KDE for end points
-bandwidth_end = 0.03
-kde_end = gaussian_kde(end_coords, bw_method=bandwidth_end)(grid_coords).reshape(X.shape)
+bandwidth_end = gaussian_kde_covariance(end_coords[0], end_coords[1], 0.03)
+kde_end = binned_kde(end_coords[0], end_coords[1], lng_grid, lat_grid, bandwidth_end)
 
 # Normalize KDE values
 kde_start_norm = (kde_start - kde_start.min()) / (kde_start.max() - kde_start.min())
@@ -67,18 +61,8 @@ gradient = {
 # Create heatmap for start points
 m_start = folium.Map(location=[37.7749, -122.4194], zoom_start=13, tiles="CartoDB positron")
 
-# Add KDE heatmap for start points
-for i in range(len(lng_grid) - 1):
-    for j in range(len(lat_grid) - 1):
-        intensity = kde_start_norm[j, i]
-        if intensity > 0:  # Only add non-zero density areas
-            folium.Rectangle(
-                bounds=[[lat_grid[j], lng_grid[i]], [lat_grid[j + 1], lng_grid[i + 1]]],
-                color=None,
-                fill=True,
-                fill_color=f'rgba(255, 0, 0, {intensity})',
-                fill_opacity=intensity
-            ).add_to(m_start)
+# Add KDE heatmap for start points as a single PNG image overlay
+add_image_overlay(m_start, kde_start_norm, lng_grid, lat_grid)
 
 # Add metro station markers to start point map
 for station in metro_stations:
@@ -100,18 +84,8 @@ print("Start heatmap saved as 'sf_bike_start_heatmap_kde.html'")
 # Create heatmap for end points
 m_end = folium.Map(location=[37.7749, -122.4194], zoom_start=13, tiles="CartoDB positron")
 
-# Add KDE heatmap for end points
-for i in range(len(lng_grid) - 1):
-    for j in range(len(lat_grid) - 1):
-        intensity = kde_end_norm[j, i]
-        if intensity > 0:  # Only add non-zero density areas
-            folium.Rectangle(
-                bounds=[[lat_grid[j], lng_grid[i]], [lat_grid[j + 1], lng_grid[i + 1]]],
-                color=None,
-                fill=True,
-                fill_color=f'rgba(255, 0, 0, {intensity})',
-                fill_opacity=intensity
-            ).add_to(m_end)
+# Add KDE heatmap for end points as a single PNG image overlay
+add_image_overlay(m_end, kde_end_norm, lng_grid, lat_grid)
 
 # Add metro station markers to end point map
 for station in metro_stations:
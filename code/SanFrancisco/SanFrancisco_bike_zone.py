@@ -1,44 +1,34 @@
-import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point, Polygon
-from shapely import wkt
+import os
+import sys
 
-# Load bike-sharing data
-bike_data = pd.read_csv('data/SanFrancisco/202008-baywheels-tripdata.csv')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-# Load grid data
-grid_data = pd.read_csv('data/SanFrancisco/grid_with_counts.csv')
+from grid_index import open_grid_index
+from grid_io import read_grid, save_grid
+from trip_counts import stream_store_counts
+from trip_loader import trip_store
 
-# Convert the geometry column of the grid data to Shapely Polygon objects
-grid_data['geometry'] = grid_data['geometry'].apply(wkt.loads)
-grid_gdf = gpd.GeoDataFrame(grid_data, geometry='geometry', crs="EPSG:4326")
+# Load grid data (GeoParquet if available, else CSV); its rows are the grid cells in cell_id order
+grid_data = read_grid('data/SanFrancisco/grid_with_counts')
 
-# Convert the start and end points of the bike data to Shapely Point objects
-bike_data['start_point'] = bike_data.apply(lambda row: Point(row['start_lng'], row['start_lat']), axis=1)
-bike_data['end_point'] = bike_data.apply(lambda row: Point(row['end_lng'], row['end_lat']), axis=1)
+# The grid parameters (origin, cell size, shape) are kept in grid_with_counts.grid.json,
+# so trip points are binned into cells arithmetically; without it the points are
+# joined against the cell polygons instead
+index = open_grid_index('data/SanFrancisco/grid_with_counts', grid_data)
 
-# Convert to GeoDataFrame
-bike_start_gdf = gpd.GeoDataFrame(bike_data, geometry='start_point', crs="EPSG:4326")
-bike_end_gdf = gpd.GeoDataFrame(bike_data, geometry='end_point', crs="EPSG:4326")
-
-# Count the number of start points within each grid
-start_join = gpd.sjoin(grid_gdf, bike_start_gdf, how='left', predicate='contains')
-start_counts = start_join.groupby(start_join.index).size()
-
-# Count the number of end points within each grid
-end_join = gpd.sjoin(grid_gdf, bike_end_gdf, how='left', predicate='contains')
-end_counts = end_join.groupby(end_join.index).size()
+# Count the start and end points within each grid, streaming the cached trip table
+# (see trip_loader.py) in fixed-size chunks so memory stays bounded
+counts = stream_store_counts(trip_store('SanFrancisco', filter_bbox=False), index,
+                             {'start': ('start_lng', 'start_lat'), 'end': ('end_lng', 'end_lat')})
 
 # Add the results to the grid data
-grid_gdf['start_count'] = grid_gdf.index.map(start_counts).fillna(0).astype(int)
-grid_gdf['end_count'] = grid_gdf.index.map(end_counts).fillna(0).astype(int)
+grid_data['start_count'] = counts['start']
+grid_data['end_count'] = counts['end']
 
 # Drop rows where all columns except 'geometry', 'start_count', and 'end_count' are zero
-cols_to_check = grid_gdf.columns.difference(['geometry', 'start_count', 'end_count'])
-grid_gdf = grid_gdf[~(grid_gdf[cols_to_check] == 0).all(axis=1).values]
-
-# Save as a new CSV file
-output_path = 'data/SanFrancisco/grid_with_bike_counts.csv'
-grid_gdf.to_csv(output_path, index=False)
+cols_to_check = grid_data.columns.difference(['geometry', 'start_count', 'end_count'])
+grid_data = grid_data[~(grid_data[cols_to_check] == 0).all(axis=1).values]
 
-print(f"Results have been saved to: {output_path}")
+# Save as GeoParquet and CSV
+for output_path in save_grid(grid_data, 'data/SanFrancisco/grid_with_bike_counts'):
+    print(f"Results have been saved to: {output_path}")
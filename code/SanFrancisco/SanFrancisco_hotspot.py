@@ -1,7 +1,13 @@
 import folium
 from folium.plugins import HeatMap
-import pandas as pd
 import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from heatmap_payload import heatmap_payload
+from trip_loader import load_trips
 
 # Step 1: Load metro station data from GeoJSON
 geojson_path = 'data/SanFrancisco/SanFrancisco_railwaystation.geojson'
@@ -15,24 +21,12 @@ for feature in metro_data['features']:
     name = feature['properties'].get('name', 'Metro Station')
     metro_stations.append({'name': name, 'coordinates': coordinates})
 
-# Step 2: Load bike-sharing data
-file_path = 'data/SanFrancisco/202008-baywheels-tripdata.csv'
-bike_data = pd.read_csv(file_path)
-
-# Step 3: Filter data within the bounding box
-lng_min, lng_max = -122.5233, -122.3551
-lat_min, lat_max = 37.7083, 37.8163
-
-filtered_data = bike_data[
-    (bike_data["start_lng"] >= lng_min) & (bike_data["start_lng"] <= lng_max) &
-    (bike_data["start_lat"] >= lat_min) & (bike_data["start_lat"] <= lat_max) &
-    (bike_data["end_lng"] >= lng_min) & (bike_data["end_lng"] <= lng_max) &
-    (bike_data["end_lat"] >= lat_min) & (bike_data["end_lat"] <= lat_max)
-]
+# Step 2: Load bike-sharing data within the bounding box (cached trip table, see trip_loader.py)
+filtered_data = load_trips('SanFrancisco')
 
-# Extract start and end coordinates
-start_coords = filtered_data[["start_lat", "start_lng"]].values.tolist()
-end_coords = filtered_data[["end_lat", "end_lng"]].values.tolist()
+# Aggregate start and end points into weighted [lat, lng, count] cells (about 2 px at zoom 16)
+start_coords = heatmap_payload(filtered_data["start_lat"], filtered_data["start_lng"], zoom=16)
+end_coords = heatmap_payload(filtered_data["end_lat"], filtered_data["end_lng"], zoom=16)
 
 # Dynamic classification legend for start points
 start_legend_html = f'''
@@ -1,46 +1,16 @@
-import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point
+import numpy as np
+import os
+import sys
 
-# 加载共享单车数据
-bike_data_path = "data/Shanghai/mobike_shanghai_sample_updated.csv"  # 替换为实际路径
-bike_data = pd.read_csv(bike_data_path)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-# 加载地铁站数据
-subway_data_path = "data/Shanghai/Shanghai_railwaystation.geojson"  # 替换为实际路径
-subway_data = gpd.read_file(subway_data_path)
+from station_index import load_station_index
+from station_ratio import within_counts
 
-# 将地铁站数据从地理坐标系 (EPSG:4326) 转换为投影坐标系 (UTM)
-subway_data = subway_data.to_crs(epsg=3857)  # 使用 Web Mercator 投影（适合大部分城市）
-
-# 为地铁站创建150米和1公里缓冲区
-subway_data['buffer_150m'] = subway_data.geometry.buffer(150)  # 150米缓冲区
-subway_data['buffer_1km'] = subway_data.geometry.buffer(1000)  # 1公里缓冲区
-
-# 将共享单车起点和终点转换为 GeoDataFrame
-start_points = gpd.GeoDataFrame(
-    bike_data,
-    geometry=gpd.points_from_xy(bike_data['start_location_x'], bike_data['start_location_y']),
-    crs="EPSG:4326"
-).to_crs(epsg=3857)  # 转换为投影坐标系
-
-end_points = gpd.GeoDataFrame(
-    bike_data,
-    geometry=gpd.points_from_xy(bike_data['end_location_x'], bike_data['end_location_y']),
-    crs="EPSG:4326"
-).to_crs(epsg=3857)  # 转换为投影坐标系
-
-# 筛选地铁站1公里范围内的共享单车（起点和终点）
-start_in_1km = start_points[start_points.geometry.within(subway_data.unary_union.buffer(1000))]
-end_in_1km = end_points[end_points.geometry.within(subway_data.unary_union.buffer(1000))]
-
-# 筛选地铁站150米范围内的共享单车（起点和终点）
-start_in_150m = start_points[start_points.geometry.within(subway_data.unary_union.buffer(150))]
-end_in_150m = end_points[end_points.geometry.within(subway_data.unary_union.buffer(150))]
-
-# 计算数量
-total_in_1km = len(start_in_1km) + len(end_in_1km)
-total_in_150m = len(start_in_150m) + len(end_in_150m)
+# 读取预先计算的站点索引（每个起终点最近的地铁站及距离，首次运行时生成），排序后按半径二分查找计数
+index = load_station_index('Shanghai')
+nearest, distance = index.nearest()
+total_in_150m, total_in_1km = within_counts(np.sort(distance), [150, 1000])
 
 # 计算比例
 proportion = total_in_150m / total_in_1km * 100
@@ -1,11 +1,17 @@
 import folium
-from scipy.stats import gaussian_kde
 import numpy as np
-import pandas as pd
 import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from kde import binned_kde, gaussian_kde_covariance
+from raster_overlay import add_image_overlay
+from trip_loader import load_trips
 
 # Step 1: Load Metro Station Data
-geojson_path = 'TIL-4030-groupwork2/data/Shanghai/Shanghai_railwaystation.geojson'
+geojson_path = 'data/Shanghai/Shanghai_railwaystation.geojson'
 with open(geojson_path, 'r') as f:
     metro_data = json.load(f)
 
@@ -16,13 +22,12 @@ for feature in metro_data['features']:
     name = feature['properties'].get('name', 'Metro Station')
     metro_stations.append({'name': name, 'coordinates': coordinates})
 
-# Step 2: Load Bike-Sharing Data
-file_path = 'TIL-4030-groupwork2/data/Shanghai/mobike_shanghai_sample_updated.csv'
-bike_data = pd.read_csv(file_path)
+# Step 2: Load bike-sharing data (cached trip table, see trip_loader.py)
+bike_data = load_trips('Shanghai', filter_bbox=False)
 
 # Extract start and end coordinates
-start_coords = np.vstack([bike_data["start_location_x"], bike_data["start_location_y"]])  # [lon, lat]
-end_coords = np.vstack([bike_data["end_location_x"], bike_data["end_location_y"]])      # [lon, lat]
+start_coords = np.vstack([bike_data["start_lng"], bike_data["start_lat"]])  # [lon, lat]
+end_coords = np.vstack([bike_data["end_lng"], bike_data["end_lat"]])      # [lon, lat]
 
 # Step 3: Compute KDE for Start and End Points
 # Define grid resolution and bandwidth
@@ -32,16 +37,15 @@ y_min, y_max = min(start_coords[1].min(), end_coords[1].min()), max(start_coords
 # Set grid resolution (1000x1000)
 x_grid = np.linspace(x_min, x_max, 1000)
 y_grid = np.linspace(y_min, y_max, 1000)
-X, Y = np.meshgrid(x_grid, y_grid)
-grid_coords = np.vstack([X.ravel(), Y.ravel()])
 
 # KDE for start points
-bandwidth_start = 0.03
-kde_start = gaussian_kde(start_coords, bw_method=bandwidth_start)(grid_coords).reshape(X.shape)
+# Kernel covariance in m^2 equal to gaussian_kde(bw_method=0.03); a scalar bandwidth in metres also works
+bandwidth_start = gaussian_kde_covariance(start_coords[0], start_coords[1], 0.03)
+kde_start = binned_kde(start_coords[0], start_coords[1], x_grid, y_grid, bandwidth_start)
 
 # KDE for end points
-bandwidth_end = 0.03
-kde_end = gaussian_kde(end_coords, bw_method=bandwidth_end)(grid_coords).reshape(X.shape)
+bandwidth_end = gaussian_kde_covariance(end_coords[0], end_coords[1], 0.03)
+kde_end = binned_kde(end_coords[0], end_coords[1], x_grid, y_grid, bandwidth_end)
 
 # Normalize KDE values
 kde_start_norm = (kde_start - kde_start.min()) / (kde_start.max() - kde_start.min())
@@ -62,18 +66,8 @@ gradient = {
 # Create heatmap for start points
 m_start = folium.Map(location=[31.23, 121.47], zoom_start=11, tiles="CartoDB positron")
 
-# Add KDE heatmap for start points
-for i in range(len(x_grid) - 1):
-    for j in range(len(y_grid) - 1):
-        intensity = kde_start_norm[j, i]
-        if intensity > 0:  # Only add non-zero density areas
-            folium.Rectangle(
-                bounds=[[y_grid[j], x_grid[i]], [y_grid[j + 1], x_grid[i + 1]]],
-                color=None,
-                fill=True,
-                fill_color=f'rgba(255, 0, 0, {intensity})',
-                fill_opacity=intensity  # Set opacity based on intensity
-            ).add_to(m_start)
+# Add KDE heatmap for start points as a single PNG image overlay
+add_image_overlay(m_start, kde_start_norm, x_grid, y_grid)
 
 # Add metro station markers to start point map
 for station in metro_stations:
@@ -93,18 +87,8 @@ print("Start heatmap saved as 'shanghai_bike_start_heatmap_kde.html'")
 # Create heatmap for end points
 m_end = folium.Map(location=[31.23, 121.47], zoom_start=11, tiles="CartoDB positron")
 
-# Add KDE heatmap for end points
-for i in range(len(x_grid) - 1):
-    for j in range(len(y_grid) - 1):
-        intensity = kde_end_norm[j, i]
-        if intensity > 0:  # Only add non-zero density areas
-            folium.Rectangle(
-                bounds=[[y_grid[j], x_grid[i]], [y_grid[j + 1], x_grid[i + 1]]],
-                color=None,
-                fill=True,
-                fill_color=f'rgba(255, 0, 0, {intensity})',
-                fill_opacity=intensity  # Set opacity based on intensity
-            ).add_to(m_end)
+# Add KDE heatmap for end points as a single PNG image overlay
+add_image_overlay(m_end, kde_end_norm, x_grid, y_grid)
 
 # Add metro station markers to end point map
 for station in metro_stations:
@@ -1,8 +1,13 @@
 import folium
 from folium.plugins import HeatMap
-import pandas as pd
 import json
-import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from heatmap_payload import heatmap_payload
+from trip_loader import load_trips
 
 # Step 1: Load metro station data from GeoJSON
 geojson_path = 'data/Shanghai/Shanghai_railwaystation.geojson'
@@ -15,13 +20,12 @@ for feature in metro_data['features']:
     name = feature['properties'].get('name', 'Metro Station')
     metro_stations.append({'name': name, 'coordinates': coordinates})
 
-# Step 2: Load bike-sharing data
-file_path = 'data/Shanghai/mobike_shanghai_sample_updated.csv'
-bike_data = pd.read_csv(file_path)
+# Step 2: Load bike-sharing data (cached trip table, see trip_loader.py)
+bike_data = load_trips('Shanghai', filter_bbox=False)
 
-# Extract start and end coordinates
-start_coords = bike_data[["start_location_y", "start_location_x"]].values.tolist()
-end_coords = bike_data[["end_location_y", "end_location_x"]].values.tolist()
+# Aggregate start and end points into weighted [lat, lng, count] cells (about 2 px at zoom 16)
+start_coords = heatmap_payload(bike_data["start_lat"], bike_data["start_lng"], zoom=16)
+end_coords = heatmap_payload(bike_data["end_lat"], bike_data["end_lng"], zoom=16)
 
 # Dynamic classification legend for start points
 start_legend_html = f'''
@@ -0,0 +1,81 @@
+"""
+Per-city inputs shared by the analysis scripts.
+
+Paths are relative to the repository root, which is where the scripts are run
+from (``python code/SanFrancisco/SanFrancisco_geodata.py``).
+
+Each grid layer is described by
+    name    short layer name, also used for timing output
+    file    GeoJSON file inside the city data directory
+    kind    'count'  -> number of features intersecting the cell
+            'length' -> length of the features clipped to the cell (m)
+            'area'   -> area of the features clipped to the cell (m^2)
+    column  output column name ('count' / 'length' layers)
+    by      attribute to split an 'area' layer on; one '<value>_area'
+            column is written per distinct value
+The order of the layers is the column order of grid_with_counts.csv.
+
+``trips`` gives the bike trip CSV, its (lon, lat) column names for the start
+and end points, the trip id and start / end timestamp columns and the study
+area ``bbox`` (lng_min, lng_max, lat_min, lat_max) trips are filtered to
+(see trip_loader.py).
+
+``metric_crs`` is the local UTM zone used for distance computations in
+metres (see coords.py).
+"""
+
+CITIES = {
+    'SanFrancisco': {
+        'data_dir': 'data/SanFrancisco',
+        'station_file': 'SanFrancisco_railwaystation.geojson',
+        'metric_crs': 'EPSG:32610',
+        'trips': {
+            'file': '202008-baywheels-tripdata.csv',
+            'start': ('start_lng', 'start_lat'),
+            'end': ('end_lng', 'end_lat'),
+            'trip_id': 'ride_id',
+            'start_time': 'started_at',
+            'end_time': 'ended_at',
+            'bbox': (-122.5233, -122.3551, 37.7083, 37.8163),
+        },
+        'layers': [
+            {'name': 'crossroad', 'file': 'crossroad.geojson', 'kind': 'count', 'column': 'crossroad_count'},
+            {'name': 'road', 'file': 'road.geojson', 'kind': 'length', 'column': 'road_length'},
+            {'name': 'shop', 'file': 'shop.geojson', 'kind': 'count', 'column': 'shop_count'},
+            {'name': 'landuse', 'file': 'landuse.geojson', 'kind': 'area', 'by': 'landuse'},
+            {'name': 'railway', 'file': 'SanFrancisco_railwaystation.geojson', 'kind': 'count', 'column': 'railway_station_count'},
+            {'name': 'bus', 'file': 'bus.geojson', 'kind': 'count', 'column': 'bus_station_count'},
+            {'name': 'bicyclelane', 'file': 'bicyclelane.geojson', 'kind': 'length', 'column': 'bicycle_lane_length'},
+        ],
+    },
+    'Shanghai': {
+        'data_dir': 'data/Shanghai',
+        'station_file': 'Shanghai_railwaystation.geojson',
+        'metric_crs': 'EPSG:32651',
+        'trips': {
+            'file': 'mobike_shanghai_sample_updated.csv',
+            'start': ('start_location_x', 'start_location_y'),
+            'end': ('end_location_x', 'end_location_y'),
+            'trip_id': 'orderid',
+            'start_time': 'start_time',
+            'end_time': 'end_time',
+            'bbox': (121.1, 121.9, 30.9, 31.5),
+        },
+        'layers': [
+            {'name': 'crossroad', 'file': 'crossroad.geojson', 'kind': 'count', 'column': 'crossroad_count'},
+            {'name': 'road', 'file': 'road.geojson', 'kind': 'length', 'column': 'road_length'},
+            {'name': 'shop', 'file': 'shop.geojson', 'kind': 'count', 'column': 'shop_count'},
+            {'name': 'landuse', 'file': 'landuse.geojson', 'kind': 'area', 'by': 'landuse'},
+            {'name': 'railway', 'file': 'Shanghai_railwaystation.geojson', 'kind': 'count', 'column': 'railway_station_count'},
+            {'name': 'bicyclelane', 'file': 'bicyclelane.geojson', 'kind': 'length', 'column': 'bicycle_lane_length'},
+            {'name': 'bus', 'file': 'bus.geojson', 'kind': 'count', 'column': 'bus_station_count'},
+        ],
+    },
+}
+
+
+def get_city(city):
+    """Return the configuration of ``city``."""
+    if city not in CITIES:
+        raise ValueError(f"Unknown city '{city}', expected one of {sorted(CITIES)}")
+    return CITIES[city]
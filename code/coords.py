@@ -0,0 +1,57 @@
+"""
+Projected coordinates for distance computations.
+
+KD-tree queries on lon/lat with "1 degree = 111 km" give ellipses instead of
+circles (a degree of longitude is shorter than a degree of latitude away
+from the equator). Here OD points and stations are projected once into the
+city's local metric CRS (UTM, see ``metric_crs`` in cities.py) and returned
+as contiguous (n, 2) float64 arrays in metres, so every cKDTree can be
+queried with radii in metres directly:
+
+    crs = get_city('SanFrancisco')['metric_crs']
+    stations = station_coords('data/SanFrancisco/SanFrancisco_railwaystation.geojson', crs)
+    od = trip_coords('SanFrancisco', crs)
+    od['start'], od['end']     # one row per point, metres
+
+Trip points come from the cached canonical trip table (trip_loader.py), the
+one memory-mapped copy the other analyses read as well, and are projected
+on the fly.
+"""
+import geopandas as gpd
+import numpy as np
+from pyproj import CRS, Transformer
+
+from trip_loader import complete_points, load_trips
+
+
+def utm_crs(lon, lat):
+    """UTM zone CRS (WGS84) containing the point (lon, lat)."""
+    zone = int((lon + 180) // 6) % 60 + 1
+    return CRS.from_epsg((32600 if lat >= 0 else 32700) + zone)
+
+
+def project(lon, lat, crs):
+    """Project lon/lat arrays to ``crs`` as a contiguous (n, 2) float64 array."""
+    transformer = Transformer.from_crs(4326, crs, always_xy=True)
+    x, y = transformer.transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+    return np.ascontiguousarray(np.column_stack([x, y]), dtype=np.float64)
+
+
+def station_coords(path, crs):
+    """Projected coordinates of the point features in the GeoJSON ``path``."""
+    stations = gpd.read_file(path).to_crs(crs)
+    return np.ascontiguousarray(np.column_stack([stations.geometry.x, stations.geometry.y]), dtype=np.float64)
+
+
+def trip_coords(city, crs, filter_bbox=False):
+    """
+    Projected start and end points of the trips of ``city``, read from the
+    cached trip store (see trip_loader.py). A point with a missing coordinate
+    is left out of its array, the other point of the trip is kept.
+    """
+    trips = load_trips(city, filter_bbox=filter_bbox, complete=False)
+    coords = {}
+    for endpoint, valid in zip(('start', 'end'), complete_points(trips)):
+        coords[endpoint] = project(trips[f'{endpoint}_lng'].to_numpy()[valid],
+                                   trips[f'{endpoint}_lat'].to_numpy()[valid], crs)
+    return coords
@@ -0,0 +1,221 @@
+"""
+Training harness for the grid demand models.
+
+The model scripts fit four regressors (linear regression, decision tree,
+random forest, gradient boosting) on the grid features for start_count and
+end_count. Here every (model, target) pair is trained as its own task in a
+process pool, on a fresh estimator, with the features sent to each worker
+once. Every fitted model is saved with joblib as a Pipeline (optional
+StandardScaler + regressor), so it can be reloaded and applied to raw
+feature columns:
+
+    data = read_features('data/SanFrancisco/grid_with_bike_counts')
+    metrics, predictions = train_models(data, scale=True, output_dir='data/SanFrancisco/models')
+    metrics       # model, target, mse, r2, fit_seconds, predict_seconds, path
+    predictions[('Random Forest', 'start_count')]      # predictions on the test cells
+
+All pairs share one 80/20 split (random_state 42), which is the split the
+scripts used for each target.
+
+With ``multi_output=True`` each model is fitted once on both targets and
+saved as <model>_joint.joblib. Linear regression and the tree models fit
+both targets natively, the trees on one float32 feature matrix shared by the
+tasks of a worker (a tree then chooses its splits on the summed MSE of both
+targets, so the decision tree and random forest scores differ from the
+per-target fits). Gradient boosting is wrapped in a MultiOutputRegressor
+behind the shared scaler, so the preprocessing runs once and its scores,
+like those of linear regression, are unchanged.
+
+From the command line (from the repository root):
+    python code/demand_models.py data/SanFrancisco/grid_with_bike_counts --scale --jobs 4 [--multi-output]
+writes the models and metrics.csv to data/SanFrancisco/models.
+"""
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+
+from grid_io import read_features
+
+TARGETS = ('start_count', 'end_count')
+# 模型名称 -> (估计器类, 默认参数)
+MODELS = {
+    'Linear Regression': (LinearRegression, {}),
+    'Decision Tree': (DecisionTreeRegressor, {'random_state': 42}),
+    'Random Forest': (RandomForestRegressor, {'random_state': 42}),
+    'Gradient Boosting': (GradientBoostingRegressor, {'random_state': 42}),
+}
+# 原生支持多目标输出的模型，其余模型用 MultiOutputRegressor 包装
+NATIVE_MULTI_OUTPUT = ('Linear Regression', 'Decision Tree', 'Random Forest')
+# 树模型内部使用 float32，联合训练时直接共用一份 float32 特征矩阵
+FLOAT32_MODELS = ('Decision Tree', 'Random Forest')
+JOINT = 'joint'
+
+# 工作进程中的训练数据，由 _init_worker 设置一次
+_features = _features32 = _targets = _train = _test = None
+
+
+def make_model(name, scale=False, multi_output=False, **params):
+    """
+    New Pipeline of model ``name`` (optionally after a StandardScaler);
+    ``params`` override the defaults. With ``multi_output`` the model predicts
+    all targets at once.
+    """
+    if name not in MODELS:
+        raise ValueError(f"Unknown model '{name}', expected one of {list(MODELS)}")
+    estimator, defaults = MODELS[name]
+    estimator = estimator(**{**defaults, **params})
+    if multi_output and name not in NATIVE_MULTI_OUTPUT:
+        estimator = MultiOutputRegressor(estimator)
+    return Pipeline([('scale', StandardScaler() if scale else 'passthrough'), ('model', estimator)])
+
+
+def model_path(output_dir, name, target):
+    """
+    File of the fitted ``name`` model for ``target``, e.g.
+    random_forest_start_count.joblib (target JOINT for multi-output models).
+    """
+    slug = re.sub(r'\W+', '_', name).strip('_').lower()
+    return os.path.join(output_dir, f'{slug}_{target}.joblib')
+
+
+def split_indices(n, test_size=0.2, random_state=42):
+    """Train and test row positions, as train_test_split would split any table of ``n`` rows."""
+    return train_test_split(np.arange(n), test_size=test_size, random_state=random_state)
+
+
+def split_features(data, targets=TARGETS):
+    """Feature columns and target columns of a grid table."""
+    return data.drop(columns=list(targets)), data[list(targets)]
+
+
+def _init_worker(features, targets, train, test):
+    global _features, _features32, _targets, _train, _test
+    _features, _targets, _train, _test = features, targets, train, test
+    _features32 = None
+
+
+def _shared_features(name, multi_output):
+    global _features32
+    if not (multi_output and name in FLOAT32_MODELS):
+        return _features
+    if _features32 is None:
+        _features32 = _features.astype(np.float32)
+    return _features32
+
+
+def _fit_task(name, targets, scale, path):
+    # targets 为多个目标时联合训练一个多输出模型
+    multi_output = len(targets) > 1
+    model = make_model(name, scale, multi_output)
+    features = _shared_features(name, multi_output)
+    X_train, X_test = features.iloc[_train], features.iloc[_test]
+    y_train = _targets[list(targets)].iloc[_train] if multi_output else _targets[targets[0]].iloc[_train]
+
+    t0 = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    y_pred = model.predict(X_test)
+    predict_seconds = time.perf_counter() - t0
+
+    if path is not None:
+        joblib.dump(model, path)
+    y_pred = y_pred.reshape(len(_test), len(targets))
+    outputs = []
+    for i, target in enumerate(targets):
+        y_test = _targets[target].iloc[_test]
+        row = {'model': name, 'target': target,
+               'mse': mean_squared_error(y_test, y_pred[:, i]), 'r2': r2_score(y_test, y_pred[:, i]),
+               'fit_seconds': fit_seconds, 'predict_seconds': predict_seconds, 'path': path}
+        outputs.append((row, y_pred[:, i]))
+    return outputs
+
+
+def _collect(task, outputs):
+    name, targets = task[:2]
+    return {(name, target): output for target, output in zip(targets, outputs)}
+
+
+def train_models(data, models=None, targets=TARGETS, scale=False, output_dir=None, n_jobs=None,
+                 test_size=0.2, random_state=42, multi_output=False):
+    """
+    Fit every model in ``models`` (names of MODELS, default all) on every
+    target column of ``data`` in up to ``n_jobs`` processes (default: one per
+    CPU, 1 runs in this process). Returns (metrics, predictions): one row per
+    (model, target) and the test-set predictions keyed by (model, target).
+    With ``multi_output`` one model per name is fitted on all targets jointly
+    (fit and predict times are those of the joint model). With ``output_dir``
+    the fitted pipelines and metrics.csv are written there.
+    """
+    models = list(models or MODELS)
+    targets = list(targets)
+    features, target_values = split_features(data, targets)
+    train, test = split_indices(len(data), test_size, random_state)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    if multi_output:
+        tasks = [(name, tuple(targets), scale, None if output_dir is None else model_path(output_dir, name, JOINT))
+                 for name in models]
+    else:
+        tasks = [(name, (target,), scale, None if output_dir is None else model_path(output_dir, name, target))
+                 for name in models for target in targets]
+
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(tasks))
+    outputs = {}
+    if n_jobs == 1:
+        _init_worker(features, target_values, train, test)
+        for task in tasks:
+            outputs.update(_collect(task, _fit_task(*task)))
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker,
+                                 initargs=(features, target_values, train, test)) as pool:
+            futures = {pool.submit(_fit_task, *task): task for task in tasks}
+            for future in as_completed(futures):
+                outputs.update(_collect(futures[future], future.result()))
+
+    metrics = pd.DataFrame([outputs[(name, target)][0] for name in models for target in targets])
+    predictions = {key: y_pred for key, (_, y_pred) in outputs.items()}
+    if output_dir is not None:
+        metrics.to_csv(os.path.join(output_dir, 'metrics.csv'), index=False)
+    return metrics, predictions
+
+
+def load_model(output_dir, name, target):
+    """Fitted pipeline of ``name`` for ``target`` (or JOINT) saved by train_models."""
+    return joblib.load(model_path(output_dir, name, target))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train all grid demand models and targets in parallel.')
+    parser.add_argument('grid', help='grid artifact, e.g. data/SanFrancisco/grid_with_bike_counts')
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), help='models to train (default: all)')
+    parser.add_argument('--scale', action='store_true', help='standardize the features first')
+    parser.add_argument('--multi-output', action='store_true', help='fit each model on both targets at once')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', help='model directory (default: models/ next to the grid)')
+    args = parser.parse_args()
+
+    output_dir = args.output or os.path.join(os.path.dirname(args.grid), 'models')
+    t0 = time.perf_counter()
+    metrics, _ = train_models(read_features(args.grid), args.models, scale=args.scale,
+                              output_dir=output_dir, n_jobs=args.jobs, multi_output=args.multi_output)
+    print(metrics.drop(columns='path').to_string(index=False))
+    print(f"Models and metrics written to '{output_dir}' in {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
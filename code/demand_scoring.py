@@ -0,0 +1,262 @@
+"""
+Scoring grids with the fitted demand models.
+
+A DemandScorer loads the pipelines saved by demand_models.py for one model
+once and predicts start_count and end_count from the feature columns it was
+trained on, whatever the column order of the input:
+
+    scorer = DemandScorer('data/Shanghai/models', 'Random Forest')
+    predictions = scorer.predict(features)      # DataFrame: start_count, end_count
+    scorer.mode                                 # 'joint' or 'per_target'
+
+A model can be saved both as one joint pipeline (<model>_joint.joblib) and
+as one pipeline per target. ``mode`` chooses: 'joint', 'per_target', or
+'auto' (default), which takes the more recently written set of files, so a
+stale joint model does not shadow retrained per-target models.
+
+score_grid streams a grid artifact in grid_with_counts format (CSV,
+Parquet or Feather) in chunks, reading only the feature columns, and writes
+one row per cell (its row position in the grid file) with the predictions.
+serve keeps the scorers warm in a local HTTP service:
+
+    GET  /health     models available and the feature columns they expect
+    GET  /models     per model: the mode and files loaded and their features
+    POST /predict    {"model": "Random Forest",                   (optional)
+                      "mode": "per_target",                       (optional, default auto)
+                      "columns": ["crossroad_count", ...],
+                      "data": [[...], ...]}                       one list per cell
+                     or {"rows": [{"crossroad_count": 3, ...}, ...]}
+                     -> {"model": ..., "mode": ..., "start_count": [...], "end_count": [...]}
+
+From the command line (from the repository root):
+    python code/demand_scoring.py score data/Shanghai/models data/Shanghai/grid_with_counts \\
+        --model "Random Forest" --output data/Shanghai/grid_predictions.csv
+    python code/demand_scoring.py serve data/Shanghai/models --port 8765
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from demand_models import JOINT, MODELS, TARGETS, load_model, model_path
+from grid_io import find_grid_file
+
+DEFAULT_MODEL = 'Random Forest'
+MODES = ('auto', 'joint', 'per_target')
+
+
+def feature_names(pipeline):
+    """Feature columns a fitted pipeline from demand_models.py was trained on."""
+    try:
+        return list(pipeline.feature_names_in_)
+    except AttributeError:
+        # 第一步为 passthrough 时，特征名保存在模型上
+        return list(pipeline[-1].feature_names_in_)
+
+
+def model_sets(model_dir, name, targets=TARGETS):
+    """Mode -> model files of ``name`` in ``model_dir``, for the complete sets only."""
+    sets = {'joint': [model_path(model_dir, name, JOINT)],
+            'per_target': [model_path(model_dir, name, target) for target in targets]}
+    return {mode: paths for mode, paths in sets.items() if all(os.path.exists(path) for path in paths)}
+
+
+def resolve_mode(model_dir, name, targets=TARGETS, mode='auto'):
+    """
+    'joint' or 'per_target': ``mode`` itself if those files exist, or for
+    'auto' the set written last (by modification time of its newest file).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {list(MODES)}")
+    sets = model_sets(model_dir, name, targets)
+    if not sets or (mode != 'auto' and mode not in sets):
+        kind = '' if mode == 'auto' else f'{mode} '
+        raise ValueError(f"No fitted {kind}model files for '{name}' in '{model_dir}'")
+    if mode != 'auto':
+        return mode
+    return max(sets, key=lambda key: max(os.path.getmtime(path) for path in sets[key]))
+
+
+class DemandScorer:
+    """
+    Fitted model ``name`` from ``model_dir`` for all targets, loaded once;
+    ``mode`` as in resolve_mode.
+    """
+
+    def __init__(self, model_dir, name=DEFAULT_MODEL, targets=TARGETS, mode='auto'):
+        self.name = name
+        self.targets = list(targets)
+        self.mode = resolve_mode(model_dir, name, self.targets, mode)
+        self.paths = model_sets(model_dir, name, self.targets)[self.mode]
+        if self.mode == 'joint':
+            self.pipelines = {JOINT: load_model(model_dir, name, JOINT)}
+        else:
+            self.pipelines = {target: load_model(model_dir, name, target) for target in self.targets}
+        self.features = feature_names(next(iter(self.pipelines.values())))
+
+    def predict(self, features):
+        """Predicted targets for the rows of the DataFrame ``features``."""
+        missing = [column for column in self.features if column not in features.columns]
+        if missing:
+            raise ValueError(f"Missing feature columns {missing} for model '{self.name}'")
+        X = features[self.features]
+        if JOINT in self.pipelines:
+            y = self.pipelines[JOINT].predict(X)
+            return pd.DataFrame(y, columns=self.targets, index=features.index)
+        return pd.DataFrame({target: self.pipelines[target].predict(X) for target in self.targets},
+                            index=features.index)
+
+
+def available_models(model_dir):
+    """Names of the models with fitted files in ``model_dir``."""
+    return [name for name in MODELS if model_sets(model_dir, name)]
+
+
+def iter_feature_chunks(path, columns, chunksize=100_000):
+    """DataFrames of ``columns`` of a grid artifact, ``chunksize`` rows at a time."""
+    file_path, fmt = find_grid_file(path)
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == 'feather':
+        with pa.memory_map(file_path) as source:
+            table = pa.ipc.open_file(source).read_all().select(columns)
+            for start in range(0, table.num_rows, chunksize):
+                yield table.slice(start, chunksize).to_pandas()
+    else:
+        yield from pd.read_csv(file_path, usecols=columns, chunksize=chunksize)
+
+
+def score_grid(model_dir, grid_path, output, name=DEFAULT_MODEL, chunksize=100_000, mode='auto'):
+    """
+    Predict the targets of every cell of ``grid_path`` and write them to the
+    CSV ``output`` (columns: cell, start_count, end_count). Returns the number
+    of cells scored.
+    """
+    scorer = DemandScorer(model_dir, name, mode=mode)
+    n_cells = 0
+    with open(output, 'w', encoding='utf-8', newline='') as f:
+        for chunk in iter_feature_chunks(grid_path, scorer.features, chunksize):
+            predictions = scorer.predict(chunk)
+            predictions.insert(0, 'cell', np.arange(n_cells, n_cells + len(chunk)))
+            predictions.to_csv(f, index=False, header=n_cells == 0)
+            n_cells += len(chunk)
+    return n_cells
+
+
+def make_handler(model_dir, default_model=DEFAULT_MODEL):
+    """Request handler class serving the models of ``model_dir``, all loaded up front and kept."""
+    scorers = {}
+    lock = threading.Lock()
+
+    def get_scorer(name, mode='auto'):
+        with lock:
+            if (name, mode) not in scorers:
+                scorers[name, mode] = DemandScorer(model_dir, name, mode=mode)
+            return scorers[name, mode]
+
+    # 启动时加载所有模型，第一次请求不必等待读取模型文件
+    for name in available_models(model_dir):
+        get_scorer(name)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                models = available_models(model_dir)
+                return self._send(200, {'models': models, 'default': default_model,
+                                        'features': {name: get_scorer(name).features for name in models}})
+            if self.path == '/models':
+                with lock:
+                    loaded = list(scorers.items())
+                return self._send(200, {'default': default_model, 'models': [
+                    {'model': name, 'requested_mode': mode, 'mode': scorer.mode,
+                     'files': [os.path.basename(path) for path in scorer.paths], 'features': scorer.features}
+                    for (name, mode), scorer in loaded]})
+            self._send(404, {'error': f"Unknown path '{self.path}'"})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self._send(404, {'error': f"Unknown path '{self.path}'"})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if 'rows' in request:
+                    features = pd.DataFrame.from_records(request['rows'])
+                else:
+                    features = pd.DataFrame(request['data'], columns=request['columns'])
+                name = request.get('model', default_model)
+                with lock:
+                    loaded = any(key[0] == name for key in scorers)
+                if not loaded and name not in available_models(model_dir):
+                    raise ValueError(f"No fitted model '{name}' in '{model_dir}'")
+                scorer = get_scorer(name, request.get('mode', 'auto'))
+                predictions = scorer.predict(features)
+            except (ValueError, KeyError, TypeError) as error:
+                return self._send(400, {'error': str(error)})
+            self._send(200, {'model': name, 'mode': scorer.mode,
+                             **{target: predictions[target].tolist() for target in predictions}})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(model_dir, host='127.0.0.1', port=8765, default_model=DEFAULT_MODEL):
+    """Run the prediction service until interrupted."""
+    handler = make_handler(model_dir, default_model)
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving {available_models(model_dir)} from '{model_dir}' on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score grids with the fitted demand models.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    score = commands.add_parser('score', help='predict every cell of a grid artifact')
+    score.add_argument('model_dir', help='directory written by demand_models.py')
+    score.add_argument('grid', help='grid artifact, e.g. data/Shanghai/grid_with_counts')
+    score.add_argument('--model', default=DEFAULT_MODEL, choices=list(MODELS), help='model to use')
+    score.add_argument('--output', help='output CSV (default: grid_predictions.csv next to the grid)')
+    score.add_argument('--chunksize', type=int, default=100_000, help='cells read per chunk')
+    score.add_argument('--mode', default='auto', choices=list(MODES),
+                       help='joint or per-target model files (default: the more recently written)')
+    service = commands.add_parser('serve', help='run the local prediction service')
+    service.add_argument('model_dir', help='directory written by demand_models.py')
+    service.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    service.add_argument('--port', type=int, default=8765, help='port to listen on')
+    service.add_argument('--model', default=DEFAULT_MODEL, choices=list(MODELS), help='default model')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.model_dir, args.host, args.port, args.model)
+        return
+    output = args.output or os.path.join(os.path.dirname(args.grid), 'grid_predictions.csv')
+    t0 = time.perf_counter()
+    mode = resolve_mode(args.model_dir, args.model, mode=args.mode)
+    n_cells = score_grid(args.model_dir, args.grid, output, args.model, args.chunksize, mode)
+    print(f"{n_cells} cells scored with {args.model} ({mode}) in {time.perf_counter() - t0:.1f} s, "
+          f"saved to '{output}'")
+
+
+if __name__ == '__main__':
+    main()
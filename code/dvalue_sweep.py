@@ -0,0 +1,149 @@
+"""
+D-value sweep over catchment radii and percentiles.
+
+For every station and catchment radius, the trips starting or ending within
+the radius are summarised by their trip distance: number of trips, average
+distance and the requested percentiles (the D-value is the 90th percentile).
+The trip CSVs are read in chunks and every (station, radius) keeps a
+QuantileSketch (see quantile_sketch.py), so any number of months is handled
+in one pass with memory bounded by the chunk size and the sketch size.
+Percentiles have a relative error of at most --accuracy (1 % by default).
+
+Usage (from the repository root):
+    python code/dvalue_sweep.py SanFrancisco
+    python code/dvalue_sweep.py Shanghai --radii 50 100 150 300 500 --percentiles 50 90 \\
+        --bbox 121.1 121.9 30.9 31.5
+The table (one row per station and radius) is written to
+<data_dir>/dvalue_sweep.csv unless --output is given.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from catchment import haversine_km, station_trip_distances
+from cities import get_city
+from quantile_sketch import QuantileSketch
+from trip_counts import read_coordinate_chunks
+from trip_loader import in_bbox
+
+DEFAULT_RADII = (50, 100, 150, 200, 300, 400, 500)
+DEFAULT_PERCENTILES = (50, 75, 90, 95)
+
+
+def load_stations(path):
+    """Names, longitudes and latitudes of the stations in a GeoJSON file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        features = json.load(f)['features']
+    names = [feature['properties'].get('name', 'Metro Station') for feature in features]
+    lon = np.array([feature['geometry']['coordinates'][0] for feature in features], dtype=np.float64)
+    lat = np.array([feature['geometry']['coordinates'][1] for feature in features], dtype=np.float64)
+    return names, lon, lat
+
+
+def sweep_sketches(trip_paths, start, end, station_lon, station_lat, radii, crs,
+                   bbox=None, chunksize=500_000, relative_accuracy=0.01):
+    """
+    One pass over the trip CSVs. Returns (sketch, distance_sums): a
+    QuantileSketch with one group per (station, radius), group id
+    station * len(radii) + radius index, and the sum of the trip distances
+    per group. ``start`` and ``end`` are the (lon, lat) columns of the trips;
+    with ``bbox`` only trips with both points inside it are used.
+    """
+    radii = np.sort(np.asarray(radii, dtype=np.float64))
+    n_groups = len(station_lon) * len(radii)
+    sketch = QuantileSketch(n_groups, relative_accuracy=relative_accuracy)
+    distance_sums = np.zeros(n_groups)
+    columns = list(dict.fromkeys([*start, *end]))
+
+    for path in trip_paths:
+        for chunk in read_coordinate_chunks(path, columns, chunksize, dtype=np.float64):
+            start_lon, start_lat = chunk[start[0]].to_numpy(), chunk[start[1]].to_numpy()
+            end_lon, end_lat = chunk[end[0]].to_numpy(), chunk[end[1]].to_numpy()
+            if bbox is not None:
+                keep = in_bbox(start_lon, start_lat, bbox) & in_bbox(end_lon, end_lat, bbox)
+                start_lon, start_lat, end_lon, end_lat = start_lon[keep], start_lat[keep], end_lon[keep], end_lat[keep]
+            trip_km = haversine_km(start_lat, start_lon, end_lat, end_lon)
+
+            # 在最大半径内查询一次，再按到站点的距离分配到各个半径
+            station, trip, station_km = station_trip_distances(
+                station_lon, station_lat, [(start_lon, start_lat), (end_lon, end_lat)], radii[-1], crs)
+            values = trip_km[trip]
+            for r, radius in enumerate(radii):
+                within = station_km <= radius / 1000
+                groups = station[within] * len(radii) + r
+                sketch.add(groups, values[within])
+                finite = ~np.isnan(values[within])
+                distance_sums += np.bincount(groups[finite], weights=values[within][finite], minlength=n_groups)
+    return sketch, distance_sums
+
+
+def sweep_table(sketch, distance_sums, station_names, radii, percentiles):
+    """Station x radius x percentile table as a DataFrame, one row per station and radius."""
+    radii = np.sort(np.asarray(radii, dtype=np.float64))
+    counts = sketch.count()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = distance_sums / counts
+    table = pd.DataFrame({
+        'station': np.repeat(np.arange(len(station_names)), len(radii)) + 1,
+        'station_name': np.repeat(station_names, len(radii)),
+        'radius_m': np.tile(radii, len(station_names)),
+        'trips': counts,
+        'average_distance': average,
+    })
+    for q in percentiles:
+        table[f'p{q:g}_distance'] = sketch.quantile(q)
+    return table
+
+
+def run_dvalue_sweep(city, radii=DEFAULT_RADII, percentiles=DEFAULT_PERCENTILES, trip_files=None,
+                     bbox=None, chunksize=500_000, relative_accuracy=0.01, filter_bbox=True):
+    """
+    D-value table of ``city`` for the trip CSVs ``trip_files`` (default: the
+    city's trip file). Like load_trips, only trips inside the city's bbox are
+    used (``bbox`` overrides it), so a sweep point reproduces the Dvalue
+    scripts; with ``filter_bbox=False`` and no ``bbox`` all trips are used.
+    """
+    config = get_city(city)
+    if bbox is None and filter_bbox:
+        bbox = config['trips']['bbox']
+    data_dir = config['data_dir']
+    trip_paths = trip_files or [os.path.join(data_dir, config['trips']['file'])]
+    names, lon, lat = load_stations(os.path.join(data_dir, config['station_file']))
+    sketch, distance_sums = sweep_sketches(trip_paths, config['trips']['start'], config['trips']['end'],
+                                           lon, lat, radii, config['metric_crs'], bbox, chunksize,
+                                           relative_accuracy)
+    return sweep_table(sketch, distance_sums, names, radii, percentiles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='D-values for several catchment radii and percentiles.')
+    parser.add_argument('city', help='SanFrancisco or Shanghai')
+    parser.add_argument('--trips', nargs='+', help='trip CSV files (default: the city trip file)')
+    parser.add_argument('--radii', type=float, nargs='+', default=list(DEFAULT_RADII),
+                        help='catchment radii in metres')
+    parser.add_argument('--percentiles', type=float, nargs='+', default=list(DEFAULT_PERCENTILES),
+                        help='trip distance percentiles (0-100)')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('LNG_MIN', 'LNG_MAX', 'LAT_MIN', 'LAT_MAX'),
+                        help="only use trips starting and ending inside this box (default: the city's bbox)")
+    parser.add_argument('--all-trips', action='store_true', help="do not filter the trips by the city's bbox")
+    parser.add_argument('--chunksize', type=int, default=500_000, help='trips read per chunk')
+    parser.add_argument('--accuracy', type=float, default=0.01, help='relative accuracy of the percentiles')
+    parser.add_argument('--output', help='output CSV (default: <data_dir>/dvalue_sweep.csv)')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    table = run_dvalue_sweep(args.city, args.radii, args.percentiles, args.trips, args.bbox,
+                             args.chunksize, args.accuracy, filter_bbox=not args.all_trips)
+    print(f"Sweep finished in {time.perf_counter() - t0:.1f} s")
+
+    output_path = args.output or os.path.join(get_city(args.city)['data_dir'], 'dvalue_sweep.csv')
+    table.to_csv(output_path, index=False)
+    print(f"D-value table saved to '{output_path}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+On-disk cache of computed grid feature layers.
+
+An entry is keyed on the content hash of the layer's input file, the target
+CRS, the grid (its CRS and cell bounds) and the aggregation settings (kind,
+column, by), so a rerun only recomputes the layers whose input or grid
+actually changed. Entries are stored as Parquet files next to an index.json
+that records their size and last use; once the cache grows beyond
+``max_bytes`` the least recently used entries are evicted.
+
+    cache = FeatureCache('data/SanFrancisco/feature_cache')
+    frame = cache.get(key)          # None on a miss
+    cache.put(key, frame)
+    print(cache.stats())            # hits, misses, evictions, entries, bytes
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS
+
+INDEX = 'index.json'
+# 修改聚合逻辑时递增，使旧的缓存条目失效
+ENGINE_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def grid_hash(grid):
+    """Hash of a grid GeoDataFrame's CRS and cell bounds."""
+    h = hashlib.sha256(CRS.from_user_input(grid.crs).to_string().encode())
+    h.update(np.ascontiguousarray(shapely.bounds(grid.geometry.values)).tobytes())
+    return h.hexdigest()
+
+
+class FeatureCache:
+    def __init__(self, path, max_bytes=512 * 1024 ** 2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._file_hashes = {}
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, INDEX)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {'clock': 0, 'entries': {}}
+        self._evict()
+
+    def _save_index(self):
+        tmp_path = os.path.join(self.path, INDEX + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, INDEX))
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, f'{key}.parquet')
+
+    def _touch(self, key):
+        self.index['clock'] += 1
+        self.index['entries'][key]['last_used'] = self.index['clock']
+
+    def input_hash(self, path):
+        """Content hash of ``path``, computed once per file version."""
+        st = os.stat(path)
+        stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if stamp not in self._file_hashes:
+            self._file_hashes[stamp] = file_hash(path)
+        return self._file_hashes[stamp]
+
+    def layer_key(self, layer, input_path, crs, grid_key):
+        """Cache key of one layer (see cities.py) computed on a grid."""
+        parts = {
+            'version': ENGINE_VERSION,
+            'input': self.input_hash(input_path),
+            'crs': CRS.from_user_input(crs).to_string(),
+            'grid': grid_key,
+            'kind': layer['kind'],
+            'column': layer.get('column'),
+            'by': layer.get('by'),
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached DataFrame of ``key``, or None."""
+        entry = self.index['entries'].get(key)
+        if entry is None or not os.path.exists(self._entry_path(key)):
+            self.index['entries'].pop(key, None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(key)
+        self._save_index()
+        return pd.read_parquet(self._entry_path(key))
+
+    def put(self, key, frame, label=None):
+        """Store ``frame`` under ``key`` and evict entries beyond max_bytes."""
+        tmp_path = self._entry_path(key) + '.tmp'
+        frame.to_parquet(tmp_path)
+        size = os.path.getsize(tmp_path)
+        if size > self.max_bytes:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self._entry_path(key))
+        self.index['entries'][key] = {'label': label, 'bytes': size}
+        self._touch(key)
+        self._save_index()
+        self._evict()
+
+    def _evict(self):
+        entries = self.index['entries']
+        total = sum(e['bytes'] for e in entries.values())
+        evicted = False
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]['bytes']
+            if os.path.exists(self._entry_path(key)):
+                os.remove(self._entry_path(key))
+            del entries[key]
+            self.evictions += 1
+            evicted = True
+        if evicted:
+            self._save_index()
+
+    def stats(self):
+        entries = self.index['entries']
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(entries), 'bytes': sum(e['bytes'] for e in entries.values())}
@@ -0,0 +1,131 @@
+"""
+Columnar grid feature store.
+
+A store is a directory holding one Parquet file per layer, keyed by cell_id,
+plus a manifest.json with the grid parameters and the columns of each layer:
+
+    data/SanFrancisco/grid_features/
+        manifest.json
+        crossroad.parquet      cell_id, crossroad_count
+        landuse.parquet        cell_id, industrial_area, commercial_area, ...
+        ...
+
+Writing a layer only rewrites that layer's file, and reads only open the
+files (and columns) that hold the requested columns. Rows are joined on
+cell_id, never on position. Cell geometries are not stored: they are rebuilt
+from the grid parameters when the store is exported.
+"""
+import json
+import os
+
+import geopandas as gpd
+import pandas as pd
+
+from grid import Grid
+
+MANIFEST = 'manifest.json'
+
+
+class FeatureStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'grid': None, 'layers': {}}
+
+    def _save_manifest(self):
+        tmp_path = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST))
+
+    def _layer_path(self, name):
+        return os.path.join(self.path, f'{name}.parquet')
+
+    @property
+    def grid(self):
+        """The Grid the stored features belong to, or None."""
+        spec = self.manifest['grid']
+        return Grid.from_dict(spec) if spec is not None else None
+
+    def set_grid(self, grid):
+        """
+        Attach ``grid`` to the store. Layers computed on a different grid are
+        dropped, since their cell ids no longer mean the same cells.
+        """
+        spec = grid.to_dict()
+        if self.manifest['grid'] != spec:
+            for name in list(self.manifest['layers']):
+                self.drop_layer(name)
+            self.manifest['grid'] = spec
+            self._save_manifest()
+
+    @property
+    def layers(self):
+        return list(self.manifest['layers'])
+
+    @property
+    def columns(self):
+        """All stored feature columns, in layer order."""
+        return [c for cols in self.manifest['layers'].values() for c in cols]
+
+    def columns_of(self, layers):
+        """Columns of the given layers, in the order given."""
+        return [c for name in layers for c in self.manifest['layers'][name]]
+
+    def write_layer(self, name, frame):
+        """Write the columns of one layer; ``frame`` is indexed by cell_id."""
+        for other, cols in self.manifest['layers'].items():
+            clash = set(cols) & set(frame.columns)
+            if other != name and clash:
+                raise ValueError(f"Columns {sorted(clash)} already belong to layer '{other}'")
+        df = frame.copy()
+        df.index.name = 'cell_id'
+        tmp_path = self._layer_path(name) + '.tmp'
+        df.reset_index().to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self._layer_path(name))
+        self.manifest['layers'][name] = list(frame.columns)
+        self._save_manifest()
+
+    def drop_layer(self, name):
+        if os.path.exists(self._layer_path(name)):
+            os.remove(self._layer_path(name))
+        self.manifest['layers'].pop(name, None)
+        self._save_manifest()
+
+    def read(self, columns=None):
+        """
+        Read ``columns`` (default: all) as a DataFrame indexed by cell_id.
+        Only the layer files holding those columns are opened.
+        """
+        if columns is None:
+            columns = self.columns
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise KeyError(f"Columns not in the store: {sorted(unknown)}")
+
+        frames = []
+        for name, cols in self.manifest['layers'].items():
+            wanted = [c for c in cols if c in columns]
+            if wanted:
+                df = pd.read_parquet(self._layer_path(name), columns=['cell_id'] + wanted)
+                frames.append(df.set_index('cell_id'))
+        grid = self.grid
+        index = pd.Index(grid.cell_id, name='cell_id') if grid is not None else None
+        if not frames:
+            return pd.DataFrame(index=index)
+        result = frames[0].join(frames[1:], how='outer') if len(frames) > 1 else frames[0]
+        if index is not None:
+            result = result.reindex(index)
+        return result[list(columns)]
+
+    def to_geodataframe(self, columns=None):
+        """Features joined to the cell polygons rebuilt from the grid."""
+        features = self.read(columns)
+        grid = self.grid.to_geodataframe()
+        return gpd.GeoDataFrame(pd.concat([grid[['geometry']], features], axis=1),
+                                geometry='geometry', crs=grid.crs)
@@ -0,0 +1,185 @@
+"""
+Array-backed analysis grids.
+
+A Grid only stores its origin, cell size and shape; cell bounds, centroids and
+ids are NumPy arrays computed on demand, and Shapely geometries are only built
+when the grid is exported with ``to_geodataframe``. This keeps grids with
+10^6+ cells cheap to create.
+
+Cells are numbered column by column, ``cell_id = col * n_rows + row``, which
+is the order the old nested-loop ``create_grid`` produced, so existing
+grid_with_counts.csv files keep their row order.
+
+Two cell shapes are supported:
+    'square'  axis-aligned cell_size x cell_size squares
+    'hex'     pointy-top hexagons, cell_size is the flat-to-flat width;
+              odd rows are shifted right by half a cell
+"""
+import math
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from pyproj import CRS
+
+SHAPES = ('square', 'hex')
+
+
+class Grid:
+    def __init__(self, xmin, ymin, cell_size, n_rows, n_cols, shape='square', crs=3857):
+        if shape not in SHAPES:
+            raise ValueError(f"Unknown cell shape '{shape}', expected one of {SHAPES}")
+        self.xmin = float(xmin)
+        self.ymin = float(ymin)
+        self.cell_size = float(cell_size)
+        self.n_rows = int(n_rows)
+        self.n_cols = int(n_cols)
+        self.shape = shape
+        self.crs = crs
+
+    @classmethod
+    def from_bounds(cls, bounds, cell_size, shape='square', crs=3857):
+        """
+        Create the smallest grid anchored at (xmin, ymin) that covers
+        ``bounds`` = [xmin, ymin, xmax, ymax].
+        """
+        xmin, ymin, xmax, ymax = bounds
+        if shape == 'square':
+            n_cols = max(1, math.ceil((xmax - xmin) / cell_size))
+            n_rows = max(1, math.ceil((ymax - ymin) / cell_size))
+        else:
+            radius = cell_size / math.sqrt(3)
+            n_cols = max(1, math.ceil((xmax - xmin) / cell_size)) + 1
+            n_rows = max(1, math.ceil((ymax - ymin) / (1.5 * radius))) + 1
+        return cls(xmin, ymin, cell_size, n_rows, n_cols, shape, crs)
+
+    @classmethod
+    def from_dict(cls, spec):
+        """Rebuild a grid from the output of ``to_dict``."""
+        return cls(**spec)
+
+    def to_dict(self):
+        """JSON-serialisable grid parameters."""
+        return {'xmin': self.xmin, 'ymin': self.ymin, 'cell_size': self.cell_size,
+                'n_rows': self.n_rows, 'n_cols': self.n_cols, 'shape': self.shape,
+                'crs': CRS.from_user_input(self.crs).to_string()}
+
+    @classmethod
+    def from_gdf(cls, gdf, cell_size, shape='square'):
+        """Grid covering the total bounds of a GeoDataFrame, in its CRS."""
+        return cls.from_bounds(gdf.total_bounds, cell_size, shape, gdf.crs)
+
+    def __len__(self):
+        return self.n_rows * self.n_cols
+
+    def __repr__(self):
+        return (f"Grid(shape={self.shape!r}, cell_size={self.cell_size}, "
+                f"n_rows={self.n_rows}, n_cols={self.n_cols})")
+
+    @property
+    def n_cells(self):
+        return len(self)
+
+    @property
+    def cell_id(self):
+        return np.arange(len(self), dtype=np.int64)
+
+    @property
+    def row(self):
+        return self.cell_id % self.n_rows
+
+    @property
+    def col(self):
+        return self.cell_id // self.n_rows
+
+    def to_cell_id(self, row, col):
+        """Cell ids of the given row / col arrays."""
+        return np.asarray(col, dtype=np.int64) * self.n_rows + np.asarray(row, dtype=np.int64)
+
+    @property
+    def hex_radius(self):
+        """Centre-to-vertex distance of a hexagonal cell."""
+        return self.cell_size / math.sqrt(3)
+
+    def centroids(self):
+        """Return (x, y) arrays of the cell centres."""
+        row, col = self.row, self.col
+        if self.shape == 'square':
+            x = self.xmin + (col + 0.5) * self.cell_size
+            y = self.ymin + (row + 0.5) * self.cell_size
+        else:
+            # 第 0 行第 0 列的中心落在 (xmin, ymin)，保证边界也被完全覆盖
+            x = self.xmin + (col + 0.5 * (row % 2)) * self.cell_size
+            y = self.ymin + row * 1.5 * self.hex_radius
+        return x, y
+
+    def bounds(self):
+        """Return (minx, miny, maxx, maxy) arrays of the cell bounding boxes."""
+        if self.shape == 'square':
+            row, col = self.row, self.col
+            minx = self.xmin + col * self.cell_size
+            miny = self.ymin + row * self.cell_size
+            return minx, miny, minx + self.cell_size, miny + self.cell_size
+        x, y = self.centroids()
+        half_w, r = self.cell_size / 2, self.hex_radius
+        return x - half_w, y - r, x + half_w, y + r
+
+    def geometries(self):
+        """Build the Shapely polygons of all cells as one vectorized call."""
+        if self.shape == 'square':
+            return shapely.box(*self.bounds())
+        x, y = self.centroids()
+        angles = np.deg2rad(30 + 60 * np.arange(6))
+        r = self.hex_radius
+        coords = np.stack([x[:, None] + r * np.cos(angles),
+                           y[:, None] + r * np.sin(angles)], axis=-1)
+        # close the rings with an exact copy of the first vertex
+        return shapely.polygons(np.concatenate([coords, coords[:, :1]], axis=1))
+
+    def locate(self, x, y):
+        """
+        Cell ids of the points (x, y), given in the grid CRS. Points outside
+        the grid get -1.
+
+        Square cells are found by floor division. For hexagonal cells the
+        point lies between the centre lines of two rows; in each of them the
+        nearest centre follows from rounding, and the closer of the two
+        candidates is the containing hexagon.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self.shape == 'square':
+            col = np.floor((x - self.xmin) / self.cell_size)
+            row = np.floor((y - self.ymin) / self.cell_size)
+        else:
+            row_height = 1.5 * self.hex_radius
+            lower = np.floor((y - self.ymin) / row_height)
+            best_row = best_col = best_d2 = None
+            for row in (lower, lower + 1):
+                shift = 0.5 * np.mod(row, 2)
+                col = np.round((x - self.xmin) / self.cell_size - shift)
+                d2 = (x - self.xmin - (col + shift) * self.cell_size) ** 2 + (y - self.ymin - row * row_height) ** 2
+                if best_d2 is None:
+                    best_row, best_col, best_d2 = row, col, d2
+                else:
+                    closer = d2 < best_d2
+                    best_row = np.where(closer, row, best_row)
+                    best_col = np.where(closer, col, best_col)
+                    best_d2 = np.where(closer, d2, best_d2)
+            row, col = best_row, best_col
+        # NaN 坐标的比较结果为 False，也会得到 -1
+        inside = (col >= 0) & (col < self.n_cols) & (row >= 0) & (row < self.n_rows)
+        ids = np.full(col.shape, -1, dtype=np.int64)
+        ids[inside] = col[inside].astype(np.int64) * self.n_rows + row[inside].astype(np.int64)
+        return ids
+
+    def to_geodataframe(self, with_rowcol=False):
+        """
+        Export the grid as a GeoDataFrame indexed by cell_id. ``with_rowcol``
+        adds the row and col columns.
+        """
+        data = {'row': self.row, 'col': self.col} if with_rowcol else {}
+        gdf = gpd.GeoDataFrame(data, geometry=self.geometries(), crs=self.crs)
+        gdf.index = self.cell_id
+        gdf.index.name = 'cell_id'
+        return gdf
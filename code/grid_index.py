@@ -0,0 +1,110 @@
+"""
+Point-to-cell lookup for grid files.
+
+Every grid_with_counts file written by the geodata scripts gets a sidecar
+``grid_with_counts.grid.json`` holding the grid parameters (origin, cell size,
+shape, number of rows / columns and CRS). With it, lon/lat arrays are mapped
+to cell ids by projecting them once and using floor division (Grid.locate),
+and counted with np.bincount; the cell polygons are never parsed.
+
+Zone files without a sidecar (irregular zones) fall back to a spatial join
+of the points against the zone polygons.
+
+    index = open_grid_index('data/SanFrancisco/grid_with_counts.csv')
+    counts = index.count(lon, lat)    # one count per row of the CSV
+"""
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+from grid import Grid
+
+
+def sidecar_path(csv_path):
+    """Path of the grid metadata file belonging to ``csv_path``."""
+    return os.path.splitext(csv_path)[0] + '.grid.json'
+
+
+class GridIndex:
+    """Cell lookup on a regular grid by projection and floor division."""
+
+    def __init__(self, grid):
+        self.grid = grid
+        self._transformer = Transformer.from_crs(4326, grid.crs, always_xy=True)
+
+    def __len__(self):
+        return len(self.grid)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(Grid.from_dict(json.load(f)))
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.grid.to_dict(), f, indent=2)
+
+    def cell_ids(self, lon, lat):
+        """Cell id of every (lon, lat) point, -1 outside the grid."""
+        x, y = self._transformer.transform(np.asarray(lon, dtype=np.float64),
+                                           np.asarray(lat, dtype=np.float64))
+        return self.grid.locate(x, y)
+
+    def count(self, lon, lat):
+        """Number of points per cell."""
+        ids = self.cell_ids(lon, lat)
+        return np.bincount(ids[ids >= 0], minlength=len(self))
+
+
+class ZoneIndex:
+    """
+    Fallback lookup on arbitrary zone polygons (lon/lat), by spatial join.
+    Cell ids are the row positions of the zones.
+    """
+
+    def __init__(self, zones):
+        self.zones = zones.to_crs(epsg=4326)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def cell_ids(self, lon, lat):
+        """Position of the zone containing every point (boundary included), -1 outside all zones."""
+        points = shapely.points(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        # intersects 包含边界上的点；点落在相邻区域的公共边界上时只计入编号最小的区域
+        point_idx, zone_idx = self.zones.sindex.query(points, predicate='intersects')
+        ids = np.full(len(points), -1, dtype=np.int64)
+        order = np.lexsort((zone_idx, point_idx))
+        point_idx, zone_idx = point_idx[order], zone_idx[order]
+        point, first = np.unique(point_idx, return_index=True)
+        ids[point] = zone_idx[first]
+        return ids
+
+    def count(self, lon, lat):
+        ids = self.cell_ids(lon, lat)
+        return np.bincount(ids[ids >= 0], minlength=len(self))
+
+
+def open_grid_index(path, grid_data=None):
+    """
+    Index for the rows of a grid file: a GridIndex if the sidecar metadata
+    exists (and matches the number of rows of ``grid_data``), else a ZoneIndex built from the
+    geometry column. ``grid_data`` is the already loaded grid (a DataFrame
+    with WKT geometries or a GeoDataFrame), if any.
+    """
+    meta_path = sidecar_path(path)
+    if os.path.exists(meta_path):
+        index = GridIndex.load(meta_path)
+        if grid_data is None or len(index) == len(grid_data):
+            return index
+    if isinstance(grid_data, gpd.GeoDataFrame):
+        return ZoneIndex(grid_data[['geometry']].reset_index(drop=True))
+    if grid_data is None:
+        grid_data = pd.read_csv(path, usecols=['geometry'])
+    zones = gpd.GeoDataFrame(geometry=shapely.from_wkt(grid_data['geometry'].values), crs='EPSG:4326')
+    return ZoneIndex(zones)
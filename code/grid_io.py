@@ -0,0 +1,103 @@
+"""
+Reading and writing grid artifacts (grid_with_counts, grid_with_bike_counts).
+
+Grids are written as GeoParquet (geometry stored as WKB), optionally Feather,
+and as the CSV with WKT polygons the older scripts expect. Readers take the
+artifact path with or without extension and prefer the binary formats:
+
+    save_grid(grid, 'data/SanFrancisco/grid_with_counts', cells)
+    grid = read_grid('data/SanFrancisco/grid_with_counts')          # GeoDataFrame
+    data = read_features('data/SanFrancisco/grid_with_bike_counts') # numeric columns only
+
+read_features never loads the geometry column, so model scripts only pay
+for the columns they train on.
+"""
+import os
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from grid_index import GridIndex, sidecar_path
+
+# 读取时的优先顺序
+FORMATS = ('parquet', 'feather', 'csv')
+
+
+def grid_path(path, fmt):
+    """``path`` with its extension replaced by ``fmt``."""
+    return os.path.splitext(path)[0] + '.' + fmt
+
+
+def find_grid_file(path):
+    """First existing file of the artifact ``path`` in FORMATS order."""
+    for fmt in FORMATS:
+        candidate = grid_path(path, fmt)
+        if os.path.exists(candidate):
+            return candidate, fmt
+    raise FileNotFoundError(f"No {'/'.join(FORMATS)} file found for '{path}'")
+
+
+def save_grid(grid, path, cells=None, formats=('parquet', 'csv')):
+    """
+    Write a grid GeoDataFrame in WGS84 in each of ``formats``. If the Grid
+    ``cells`` is given, its parameters are written to the sidecar
+    <name>.grid.json (see grid_index.py). Returns the written paths.
+    """
+    grid = grid.to_crs(epsg=4326)
+    written = []
+    for fmt in formats:
+        out_path = grid_path(path, fmt)
+        if fmt == 'parquet':
+            grid.to_parquet(out_path, index=False)
+        elif fmt == 'feather':
+            grid.reset_index(drop=True).to_feather(out_path)
+        elif fmt == 'csv':
+            grid.to_csv(out_path, index=False)
+        else:
+            raise ValueError(f"Unknown grid format '{fmt}', expected one of {FORMATS}")
+        written.append(out_path)
+    if cells is not None:
+        GridIndex(cells).save(sidecar_path(path))
+    return written
+
+
+def read_grid(path, columns=None):
+    """Read a grid artifact as a GeoDataFrame (geometry plus ``columns``)."""
+    file_path, fmt = find_grid_file(path)
+    if columns is not None:
+        columns = ['geometry'] + [c for c in columns if c != 'geometry']
+    if fmt == 'parquet':
+        return gpd.read_parquet(file_path, columns=columns)
+    if fmt == 'feather':
+        return gpd.read_feather(file_path, columns=columns)
+    df = pd.read_csv(file_path, usecols=columns)
+    return gpd.GeoDataFrame(df, geometry=shapely.from_wkt(df.pop('geometry').values), crs='EPSG:4326')
+
+
+def column_names(path):
+    """Column names of a grid artifact, read from its schema or header only."""
+    file_path, fmt = find_grid_file(path)
+    if fmt == 'parquet':
+        return pq.read_schema(file_path).names
+    if fmt == 'feather':
+        with pa.memory_map(file_path) as source:
+            return pa.ipc.open_file(source).schema.names
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
+def read_features(path, columns=None):
+    """
+    Read the non-geometry columns of a grid artifact as a plain DataFrame,
+    without loading the geometry. ``columns`` restricts the read further.
+    """
+    file_path, fmt = find_grid_file(path)
+    if columns is None:
+        columns = [c for c in column_names(path) if c != 'geometry']
+    if fmt == 'parquet':
+        return pd.read_parquet(file_path, columns=columns)
+    if fmt == 'feather':
+        return pd.read_feather(file_path, columns=columns)
+    return pd.read_csv(file_path, usecols=columns)[columns]
@@ -0,0 +1,166 @@
+"""
+Multi-resolution grid sweep.
+
+Computes the grid features (and, if the trip CSV is available, the bike
+start/end counts) once on a fine base grid and derives every coarser
+resolution by exact aggregation of the base cells, writing
+    data/<size>km_<city>/grid_with_counts.parquet / .csv
+    data/<size>km_<city>/grid_with_bike_counts.parquet / .csv
+for each requested resolution in one run.
+
+Every resolution must be an integer multiple of the base cell size, and all
+grids share the origin of the stations' bounding box, so each coarse cell is
+exactly a block of base cells:
+    * length / area layers are clipped at the base resolution and summed,
+    * count layers keep the (feature, base cell) pairs and count each feature
+      once per coarse cell it intersects, which equals a direct count at the
+      coarse resolution,
+    * trip points are binned into exactly one base cell and summed.
+
+Usage (from the repository root):
+    python code/grid_sweep.py Shanghai --base 500 --resolutions 1500 2000 2500 3000 4000
+"""
+import argparse
+import math
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+
+from cities import get_city
+from grid import Grid
+from grid_index import GridIndex
+from grid_io import save_grid
+from grid_features import METRIC_CRS, aggregate_layer, intersecting_pairs, load_layer, print_timings
+from trip_counts import stream_cell_counts
+
+
+def base_grid_for(bounds, base_size, resolutions):
+    """
+    Base grid covering every coarse grid: each coarse grid has the shape
+    ``Grid.from_bounds(bounds, resolution)`` would give it.
+    """
+    xmin, ymin = bounds[0], bounds[1]
+    n_rows = n_cols = 1
+    for resolution in resolutions:
+        coarse = Grid.from_bounds(bounds, resolution)
+        factor = resolution_factor(base_size, resolution)
+        n_rows = max(n_rows, coarse.n_rows * factor)
+        n_cols = max(n_cols, coarse.n_cols * factor)
+    return Grid(xmin, ymin, base_size, n_rows, n_cols, crs=METRIC_CRS)
+
+
+def resolution_factor(base_size, resolution):
+    """Number of base cells per coarse cell side."""
+    factor = resolution / base_size
+    if factor < 1 or not math.isclose(factor, round(factor)):
+        raise ValueError(f"Resolution {resolution} m is not a multiple of the base cell size {base_size} m")
+    return int(round(factor))
+
+
+def parent_ids(base, coarse):
+    """Coarse cell id of every base cell, -1 where the coarse grid ends."""
+    factor = resolution_factor(base.cell_size, coarse.cell_size)
+    row, col = base.row // factor, base.col // factor
+    inside = (row < coarse.n_rows) & (col < coarse.n_cols)
+    return np.where(inside, coarse.to_cell_id(row, col), -1)
+
+
+def sum_to_parent(values, parents, n_coarse):
+    """Sum base-cell values into their coarse cells."""
+    keep = parents >= 0
+    return np.bincount(parents[keep], weights=values[keep], minlength=n_coarse)
+
+
+def run_sweep(city, resolutions, base_size=500, output_root='data', with_trips=True):
+    """
+    Compute the features of ``city`` on a ``base_size`` grid and write one
+    grid_with_counts.csv (and grid_with_bike_counts.csv) per resolution.
+    Returns the per-layer timings of the base pass.
+    """
+    config = get_city(city)
+    data_dir = config['data_dir']
+    railway_gdf = load_layer(os.path.join(data_dir, config['station_file']))
+    bounds = railway_gdf.total_bounds
+
+    base = base_grid_for(bounds, base_size, resolutions)
+    base_gdf = base.to_geodataframe()
+    _ = base_gdf.sindex  # 在逐图层查询之前只建立一次基础网格的空间索引
+    coarse_grids = {r: Grid.from_bounds(bounds, r) for r in resolutions}
+    parents = {r: parent_ids(base, g) for r, g in coarse_grids.items()}
+    print(f"Base grid: {len(base)} cells of {base_size:g} m")
+
+    # 1. 在基础网格上遍历一次所有图层
+    columns = {r: {} for r in resolutions}
+    timings = []
+    for layer in config['layers']:
+        t0 = time.perf_counter()
+        gdf = load_layer(os.path.join(data_dir, layer['file']))
+        t1 = time.perf_counter()
+        if layer['kind'] == 'count':
+            feature_idx, cell_idx = intersecting_pairs(base_gdf, gdf)
+            for r, coarse in coarse_grids.items():
+                coarse_idx = parents[r][cell_idx]
+                keep = coarse_idx >= 0
+                # 每个要素在每个粗网格中只计一次
+                pairs = np.unique(feature_idx[keep] * len(coarse) + coarse_idx[keep])
+                columns[r][layer['column']] = np.bincount(pairs % len(coarse), minlength=len(coarse))
+        else:
+            base_values = aggregate_layer(base_gdf, gdf, layer['kind'],
+                                          column=layer.get('column'), by=layer.get('by'))
+            for r, coarse in coarse_grids.items():
+                for name in base_values.columns:
+                    columns[r][name] = sum_to_parent(base_values[name].values, parents[r], len(coarse))
+        t2 = time.perf_counter()
+        timings.append({'layer': layer['name'], 'features': len(gdf),
+                        'load_s': t1 - t0, 'aggregate_s': t2 - t1})
+
+    # 2. 共享单车起终点只分箱一次
+    trip_counts = None
+    trip_path = os.path.join(data_dir, config['trips']['file'])
+    if with_trips and os.path.exists(trip_path):
+        t0 = time.perf_counter()
+        trip_counts = stream_cell_counts(trip_path, GridIndex(base), {'start': config['trips']['start'],
+                                                           'end': config['trips']['end']})
+        timings.append({'layer': 'trips', 'features': int(trip_counts['start'].sum()),
+                        'load_s': 0.0, 'aggregate_s': time.perf_counter() - t0})
+    elif with_trips:
+        print(f"Trip file '{trip_path}' not found, skipping grid_with_bike_counts.csv")
+
+    # 3. 为每个分辨率写出结果
+    for r, coarse in coarse_grids.items():
+        out_dir = os.path.join(output_root, f'{r / 1000:g}km_{city}')
+        os.makedirs(out_dir, exist_ok=True)
+        grid = gpd.GeoDataFrame(columns[r], geometry=coarse.geometries(), crs=METRIC_CRS)
+        grid = grid[['geometry'] + list(columns[r])]
+        save_grid(grid, os.path.join(out_dir, 'grid_with_counts'), coarse)
+        grid = grid.to_crs(epsg=4326)
+
+        if trip_counts is not None:
+            feature_cols = list(columns[r])
+            for kind in ('start', 'end'):
+                grid[f'{kind}_count'] = sum_to_parent(trip_counts[kind], parents[r], len(coarse)).astype(int)
+            # 删除除 geometry、start_count、end_count 外全为 0 的网格
+            grid = grid[~(grid[feature_cols] == 0).all(axis=1).values]
+            save_grid(grid, os.path.join(out_dir, 'grid_with_bike_counts'))
+        print(f"{r:g} m: {len(coarse)} cells written to '{out_dir}'")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write grid_with_counts.csv for several resolutions in one pass.')
+    parser.add_argument('city', help='SanFrancisco or Shanghai')
+    parser.add_argument('--base', type=float, default=500, help='base cell size in metres')
+    parser.add_argument('--resolutions', type=float, nargs='+', default=[1500, 2000, 2500, 3000, 4000],
+                        help='output cell sizes in metres, multiples of the base size')
+    parser.add_argument('--output-root', default='data', help='directory the <size>km_<city> folders go to')
+    parser.add_argument('--no-trips', action='store_true', help='do not write grid_with_bike_counts.csv')
+    args = parser.parse_args()
+
+    timings = run_sweep(args.city, args.resolutions, args.base, args.output_root, not args.no_trips)
+    print_timings(timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Pre-aggregated point payloads for folium.plugins.HeatMap.
+
+HeatMap serializes every point into the HTML. Here the points are snapped to
+a grid of ``cell_px`` screen pixels at ``zoom`` (Web Mercator pixel
+coordinates) and each occupied cell becomes one weighted point
+[lat, lng, count] at the mean position of its points. Leaflet.heat sums the
+weights of nearby points anyway, so the map looks the same while the HTML
+holds one entry per cell. If there are more than ``max_points`` cells, the
+cells are doubled in size until they fit:
+
+    HeatMap(data=heatmap_payload(lat, lng, zoom=16, max_points=50_000), max_zoom=16, radius=15)
+"""
+import numpy as np
+
+from raster_overlay import TILE_SIZE, mercator_y
+
+
+def pixel_coords(lat, lon, zoom):
+    """Web Mercator pixel coordinates (x, y) at ``zoom``."""
+    scale = TILE_SIZE * 2 ** zoom
+    x = (np.asarray(lon, dtype=np.float64) + 180) / 360 * scale
+    y = (1 - mercator_y(np.asarray(lat, dtype=np.float64)) / np.pi) / 2 * scale
+    return x, y
+
+
+def aggregate_points(lat, lon, x, y, cell_px):
+    """(lat, lng, count) of the points per occupied cell of ``cell_px`` pixels."""
+    cx = np.floor(x / cell_px).astype(np.int64)
+    cy = np.floor(y / cell_px).astype(np.int64)
+    cx -= cx.min()
+    cy -= cy.min()
+    _, cell, counts = np.unique(cx * (cy.max() + 1) + cy, return_inverse=True, return_counts=True)
+    mean_lat = np.bincount(cell, weights=lat) / counts
+    mean_lon = np.bincount(cell, weights=lon) / counts
+    # 6 位小数（约 0.1 m）足够定位，同时缩短 HTML 中的数字
+    return np.column_stack([np.round(mean_lat, 6), np.round(mean_lon, 6), counts])
+
+
+def heatmap_payload(lat, lon, zoom=16, cell_px=2, max_points=50_000):
+    """
+    Weighted [lat, lng, weight] list for HeatMap with at most ``max_points``
+    entries. Points with missing coordinates are dropped.
+    """
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    keep = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon = lat[keep], lon[keep]
+    if len(lat) == 0:
+        return []
+    x, y = pixel_coords(lat, lon, zoom)
+    payload = aggregate_points(lat, lon, x, y, cell_px)
+    while len(payload) > max_points:
+        cell_px *= 2
+        payload = aggregate_points(lat, lon, x, y, cell_px)
+    return payload.tolist()
@@ -0,0 +1,309 @@
+"""
+Hyperparameter search for the grid demand models.
+
+Every candidate of the four model families (see demand_models.py) is scored
+by K-fold cross-validation (MSE and R2 per target). The fold assignment and
+the feature matrix of each fold (standardized with that fold's training rows
+when ``scale`` is set) are computed once and placed in shared memory; the
+worker processes map them read-only instead of receiving a copy per task.
+
+Strategies:
+    grid      every combination of PARAM_SPACES
+    random    ``n_candidates`` combinations sampled from PARAM_SPACES
+    halving   successive halving over the random candidates: each round
+              trains on a fraction of the training rows of every fold and
+              keeps the best 1/eta candidates (by mean CV MSE) for the next
+              round, until the last round uses all rows
+
+Every finished evaluation is appended to a checkpoint (JSON lines) in
+``checkpoint_dir``, named after a fingerprint of the data and fold settings;
+a search started again with the same settings skips what is already in it,
+so an interrupted search resumes where it stopped. Each row reports the
+fit, predict and wall time of the candidate:
+
+    results = search(read_features('data/Shanghai/grid_with_bike_counts'), strategy='halving',
+                     checkpoint_dir='data/Shanghai/models')
+    best = best_candidates(results)
+
+From the command line (from the repository root):
+    python code/model_search.py data/Shanghai/grid_with_bike_counts --strategy random --candidates 30 --jobs 4
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import KFold, ParameterGrid, ParameterSampler
+from sklearn.preprocessing import StandardScaler
+
+from demand_models import MODELS, TARGETS, make_model, split_features
+from grid_io import read_features
+
+STRATEGIES = ('grid', 'random', 'halving')
+# 修改评估方式时递增，使旧的断点文件失效
+SEARCH_VERSION = 1
+# 各模型的超参数搜索空间
+PARAM_SPACES = {
+    'Linear Regression': {'fit_intercept': [True, False]},
+    'Decision Tree': {
+        'max_depth': [None, 4, 8, 16],
+        'min_samples_leaf': [1, 2, 5, 10],
+    },
+    'Random Forest': {
+        'n_estimators': [100, 200, 400],
+        'max_depth': [None, 8, 16],
+        'max_features': [1.0, 0.5, 'sqrt'],
+        'min_samples_leaf': [1, 2, 5],
+    },
+    'Gradient Boosting': {
+        'n_estimators': [100, 200, 400],
+        'learning_rate': [0.03, 0.1, 0.3],
+        'max_depth': [2, 3, 5],
+        'subsample': [1.0, 0.8],
+    },
+}
+
+# 工作进程中的共享数据，由 _init_worker 设置一次
+_fold_features = _targets = _folds = _train_order = None
+_segments = []
+
+
+def fold_assignment(n, n_splits=5, random_state=42):
+    """Fold number of every row, from a shuffled KFold."""
+    folds = np.empty(n, dtype=np.int32)
+    for k, (_, test) in enumerate(KFold(n_splits, shuffle=True, random_state=random_state).split(np.arange(n))):
+        folds[test] = k
+    return folds
+
+
+def fold_features(features, folds, scale=False):
+    """
+    (folds, rows, features) float64 matrices; with ``scale`` fold k is
+    standardized with the mean and variance of the rows outside fold k,
+    otherwise the raw features are returned once as (1, rows, features).
+    """
+    features = np.asarray(features, dtype=np.float64)
+    if not scale:
+        return features[None]
+    n_splits = int(folds.max()) + 1
+    return np.stack([StandardScaler().fit(features[folds != k]).transform(features) for k in range(n_splits)])
+
+
+def candidates(space, strategy='grid', n_candidates=20, random_state=42):
+    """Parameter dicts of ``space`` to evaluate for ``strategy``."""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown search strategy '{strategy}', expected one of {STRATEGIES}")
+    grid = list(ParameterGrid(space))
+    if strategy == 'grid' or n_candidates >= len(grid):
+        return grid
+    return list(ParameterSampler(space, n_candidates, random_state=random_state))
+
+
+def _share(array):
+    segment = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    # 进程池的子进程与主进程共用 resource_tracker，共享内存由主进程释放（或在主进程被终止后由 tracker 清理）
+    segment = SharedMemory(name=name)
+    _segments.append(segment)
+    view = np.ndarray(shape, dtype, buffer=segment.buf)
+    view.flags.writeable = False
+    return view
+
+
+def _init_worker(fold_features, targets, folds, train_order, shared=True):
+    global _fold_features, _targets, _folds, _train_order
+    if shared:
+        fold_features, targets, folds, train_order = map(_attach, (fold_features, targets, folds, train_order))
+    _fold_features, _targets, _folds, _train_order = fold_features, targets, folds, train_order
+
+
+def _evaluate(name, target, params, budget):
+    started = time.perf_counter()
+    fit_seconds = predict_seconds = 0.0
+    mse, r2 = [], []
+    for k in range(int(_folds.max()) + 1):
+        X = _fold_features[k if len(_fold_features) > 1 else 0]
+        train = _train_order[_folds[_train_order] != k][:budget]
+        test = np.flatnonzero(_folds == k)
+        model = make_model(name, **params)
+
+        t0 = time.perf_counter()
+        model.fit(X[train], _targets[train, target])
+        fit_seconds += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        y_pred = model.predict(X[test])
+        predict_seconds += time.perf_counter() - t0
+        mse.append(mean_squared_error(_targets[test, target], y_pred))
+        r2.append(r2_score(_targets[test, target], y_pred))
+    return {'mean_mse': float(np.mean(mse)), 'std_mse': float(np.std(mse)), 'mean_r2': float(np.mean(r2)),
+            'fit_seconds': fit_seconds, 'predict_seconds': predict_seconds,
+            'wall_seconds': time.perf_counter() - started}
+
+
+def _fingerprint(features, targets, n_splits, random_state, scale):
+    digest = hashlib.sha256()
+    for values in (features, targets):
+        digest.update(json.dumps(list(values.columns)).encode())
+        digest.update(np.ascontiguousarray(values.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(json.dumps([n_splits, random_state, bool(scale), SEARCH_VERSION]).encode())
+    return digest.hexdigest()[:16]
+
+
+def _task_key(name, target, params, budget):
+    return json.dumps([name, target, params, budget], sort_keys=True)
+
+
+def _load_checkpoint(path):
+    done = {}
+    if path is not None and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断时可能写了半行，忽略
+                    continue
+                done[_task_key(row['model'], row['target'], row['params'], row['budget'])] = row
+    return done
+
+
+def _run_tasks(tasks, done, checkpoint, pool, init_args):
+    """Evaluate the (model, target, params, budget) ``tasks`` not in ``done``; returns all their rows."""
+    todo = [task for task in tasks if _task_key(*task) not in done]
+    with open(checkpoint, 'a+', encoding='utf-8') if checkpoint else open(os.devnull, 'w') as log:
+        if checkpoint and log.tell() > 0:
+            # 上次中断在半行处时先换行，避免与新记录连在一起
+            log.seek(log.tell() - 1)
+            if log.read(1) != '\n':
+                log.write('\n')
+        def record(task, scores):
+            name, target, params, budget = task
+            row = {'model': name, 'target': target, 'params': params, 'budget': budget, **scores}
+            done[_task_key(*task)] = row
+            log.write(json.dumps(row) + '\n')
+            log.flush()
+
+        if pool is None:
+            _init_worker(*init_args, shared=False)
+            for task in todo:
+                record(task, _evaluate(*task))
+        else:
+            futures = {pool.submit(_evaluate, *task): task for task in todo}
+            for future in as_completed(futures):
+                record(futures[future], future.result())
+    return [done[_task_key(*task)] for task in tasks]
+
+
+def search(data, models=None, targets=TARGETS, strategy='grid', n_candidates=20, eta=3, scale=False,
+           n_splits=5, random_state=42, n_jobs=None, checkpoint_dir=None, spaces=None, min_budget=20):
+    """
+    Cross-validated search over ``spaces`` (default PARAM_SPACES) for every
+    model in ``models`` and every target column. Returns one row per
+    evaluated (model, target, params, budget); ``budget`` is the number of
+    training rows per fold (None: all of them). With ``checkpoint_dir``
+    results are checkpointed there and reused when the search is rerun.
+    """
+    models = list(models or MODELS)
+    targets = list(targets)
+    spaces = spaces or PARAM_SPACES
+    features, target_values = split_features(data, targets)
+    folds = fold_assignment(len(data), n_splits, random_state)
+    rng = np.random.default_rng(random_state)
+    arrays = (fold_features(features, folds, scale), target_values.to_numpy(dtype=np.float64), folds,
+              rng.permutation(len(data)))
+
+    checkpoint = None
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        fingerprint = _fingerprint(features, target_values, n_splits, random_state, scale)
+        checkpoint = os.path.join(checkpoint_dir, f'search_{fingerprint}.jsonl')
+    done = _load_checkpoint(checkpoint)
+
+    pool, segments = None, []
+    n_jobs = n_jobs or os.cpu_count() or 1
+    try:
+        init_args = arrays
+        if n_jobs > 1:
+            segments, specs = zip(*map(_share, arrays))
+            pool = ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=specs)
+
+        pending = {(name, t): candidates(spaces[name], strategy, n_candidates, random_state)
+                   for name in models for t in range(len(targets))}
+        n_train = len(data) - int(np.bincount(folds).max())
+        if strategy == 'halving':
+            n_rounds = max(1 + math.ceil(math.log(max(len(c) for c in pending.values()), eta)), 1)
+            budgets = [max(int(n_train / eta ** (n_rounds - 1 - r)), min(min_budget, n_train))
+                       for r in range(n_rounds)]
+            budgets[-1] = None
+        else:
+            budgets = [None]
+
+        rows = []
+        for r, budget in enumerate(budgets):
+            tasks = [(name, t, params, budget) for (name, t), params_list in pending.items() for params in params_list]
+            round_rows = _run_tasks(tasks, done, checkpoint, pool, init_args)
+            rows.extend(round_rows)
+            if r < len(budgets) - 1:
+                # 每个 (模型, 目标) 只保留均方误差最小的 1/eta 个候选
+                for key, params_list in pending.items():
+                    scored = [row for row in round_rows if (row['model'], row['target']) == key]
+                    scored.sort(key=lambda row: row['mean_mse'])
+                    pending[key] = [row['params'] for row in scored[:max(math.ceil(len(scored) / eta), 1)]]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    results = pd.DataFrame(rows)
+    results['target'] = [targets[t] for t in results['target']]
+    results['params'] = [json.dumps(params, sort_keys=True) for params in results['params']]
+    return results
+
+
+def best_candidates(results):
+    """Best candidate (lowest mean CV MSE with all training rows) per model and target."""
+    full = results[results['budget'].isna()]
+    return full.loc[full.groupby(['model', 'target'])['mean_mse'].idxmin()].reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-validated hyperparameter search for the demand models.')
+    parser.add_argument('grid', help='grid artifact, e.g. data/Shanghai/grid_with_bike_counts')
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), help='model families (default: all)')
+    parser.add_argument('--strategy', choices=STRATEGIES, default='grid', help='search strategy')
+    parser.add_argument('--candidates', type=int, default=20, help='candidates per model (random / halving)')
+    parser.add_argument('--eta', type=float, default=3, help='halving factor')
+    parser.add_argument('--folds', type=int, default=5, help='number of CV folds')
+    parser.add_argument('--scale', action='store_true', help='standardize the features per fold')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', help='checkpoint / result directory (default: models/ next to the grid)')
+    args = parser.parse_args()
+
+    output_dir = args.output or os.path.join(os.path.dirname(args.grid), 'models')
+    t0 = time.perf_counter()
+    results = search(read_features(args.grid), args.models, strategy=args.strategy, n_candidates=args.candidates,
+                     eta=args.eta, scale=args.scale, n_splits=args.folds, n_jobs=args.jobs,
+                     checkpoint_dir=output_dir)
+    results.to_csv(os.path.join(output_dir, 'search_results.csv'), index=False)
+    best = best_candidates(results)
+    print(best[['model', 'target', 'params', 'mean_mse', 'mean_r2', 'wall_seconds']].to_string(index=False))
+    print(f"{len(results)} evaluations in {time.perf_counter() - t0:.1f} s, "
+          f"results in '{os.path.join(output_dir, 'search_results.csv')}'")
+
+
+if __name__ == '__main__':
+    main()
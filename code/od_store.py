@@ -0,0 +1,124 @@
+"""
+On-disk store of OD points (one row per trip) for zero-copy sharing.
+
+A store is a directory with one fixed-width column per file and a
+manifest.json describing them:
+
+    <store>/start_lng.npy, start_lat.npy, ...    np.save format, read with np.memmap
+    <store>/od_points.arrow                      optional Arrow IPC file (uncompressed)
+    <store>/manifest.json                        rows, column dtypes, formats, source
+
+Columns are opened memory-mapped, so loading takes no time regardless of the
+number of trips and several analyses or processes reading the same store
+share one copy in the OS page cache. The manifest is written last; a
+directory without it is an incomplete store. Stores are written by
+trip_loader.py (``python code/trip_loader.py <city> --output <store>``):
+
+    store = ODStore('data/SanFrancisco/od_points')
+    lng = store['start_lng']             # np.memmap, read-only
+    trips = store.to_frame()             # DataFrame over the memory-mapped columns
+    for chunk in store.iter_chunks(['start_lng', 'start_lat']):   # bounded-memory passes
+        ...
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+MANIFEST = 'manifest.json'
+ARROW_FILE = 'od_points.arrow'
+FORMATS = ('npy', 'arrow')
+
+
+def write_store(path, columns, meta=None, formats=('npy',)):
+    """Write the arrays ``columns`` (name -> array, equal lengths) as a store at ``path``."""
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns of an OD store must have equal lengths, got {sorted(lengths)}")
+    os.makedirs(path, exist_ok=True)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    for fmt in formats:
+        if fmt == 'npy':
+            for name, values in columns.items():
+                np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(values))
+        elif fmt == 'arrow':
+            table = pa.table({name: pa.array(values) for name, values in columns.items()})
+            with pa.OSFile(os.path.join(path, ARROW_FILE), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            raise ValueError(f"Unknown OD store format '{fmt}', expected one of {FORMATS}")
+
+    manifest = {
+        'rows': lengths.pop() if lengths else 0,
+        'columns': {name: np.asarray(values).dtype.str for name, values in columns.items()},
+        'formats': list(formats),
+        'meta': meta or {},
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return ODStore(path)
+
+
+def is_store(path):
+    """Whether ``path`` holds a complete store."""
+    return os.path.exists(os.path.join(path, MANIFEST))
+
+
+class ODStore:
+    """Read-only, memory-mapped access to a store written by write_store."""
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.fmt = fmt or self.manifest['formats'][0]
+        if self.fmt not in self.manifest['formats']:
+            raise ValueError(f"OD store '{path}' has no {self.fmt} files (has {self.manifest['formats']})")
+        self._arrow = None
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def __contains__(self, name):
+        return name in self.manifest['columns']
+
+    @property
+    def columns(self):
+        return list(self.manifest['columns'])
+
+    @property
+    def meta(self):
+        return self.manifest['meta']
+
+    def __getitem__(self, name):
+        """Column ``name`` without copying (np.memmap for .npy, Arrow buffer view otherwise)."""
+        if name not in self:
+            raise KeyError(f"OD store '{self.path}' has no column '{name}'")
+        if self.fmt == 'npy':
+            return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        if self._arrow is None:
+            self._arrow = pa.ipc.open_file(pa.memory_map(os.path.join(self.path, ARROW_FILE))).read_all()
+        column = self._arrow.column(name)
+        # 定长数值列零拷贝；字节串列（行程 ID）需要复制
+        zero_copy = column.num_chunks == 1 and pa.types.is_primitive(column.type)
+        values = column.chunk(0) if column.num_chunks == 1 else column
+        return values.to_numpy(zero_copy_only=zero_copy) if zero_copy else np.asarray(
+            values.to_numpy(zero_copy_only=False), dtype=self.manifest['columns'][name])
+
+    def iter_chunks(self, columns=None, chunksize=500_000):
+        """Dicts of ``columns`` (all by default), ``chunksize`` rows at a time, as views into the store."""
+        columns = columns or self.columns
+        arrays = {name: self[name] for name in columns}
+        for start in range(0, len(self), chunksize):
+            yield {name: values[start:start + chunksize] for name, values in arrays.items()}
+
+    def to_frame(self, columns=None):
+        """DataFrame over the (memory-mapped) ``columns``, all columns by default."""
+        columns = columns or self.columns
+        return pd.DataFrame({name: self[name] for name in columns}, copy=False)
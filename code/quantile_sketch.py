@@ -0,0 +1,87 @@
+"""
+Mergeable quantile sketches for many groups at once.
+
+Each group (e.g. a station and catchment radius) keeps a histogram over
+logarithmically spaced buckets, as in DDSketch: bucket k holds the values in
+(min_value * gamma^(k-1), min_value * gamma^k] with
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy), so any quantile is
+returned with a relative error of at most ``relative_accuracy``. Values up to
+``min_value`` share bucket 0 and are reported as 0.
+
+Memory is n_groups x n_buckets counts, independent of the number of values
+added. Sketches with the same parameters merge by adding their counts, so
+chunks, months or processes can be sketched separately and combined:
+
+    sketch = QuantileSketch(n_groups)
+    for groups, values in chunks:
+        sketch.add(groups, values)
+    sketch.quantile(90)        # one value per group, NaN for empty groups
+"""
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+    def __init__(self, n_groups, relative_accuracy=0.01, min_value=1e-3, max_value=1e3):
+        self.n_groups = n_groups
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.n_buckets = int(math.ceil(math.log(max_value / min_value) / self._log_gamma)) + 1
+        self.counts = np.zeros((n_groups, self.n_buckets), dtype=np.int64)
+
+    def _params(self):
+        return (self.n_groups, self.relative_accuracy, self.min_value, self.max_value)
+
+    def bucket(self, values):
+        """Bucket index of each value; values above max_value go to the last bucket."""
+        values = np.asarray(values, dtype=np.float64)
+        ratio = np.maximum(values, self.min_value) / self.min_value
+        index = np.ceil(np.log(ratio) / self._log_gamma)
+        return np.clip(index, 0, self.n_buckets - 1).astype(np.int64)
+
+    def bucket_values(self):
+        """Value reported for each bucket (relative error <= relative_accuracy)."""
+        k = np.arange(self.n_buckets)
+        values = self.min_value * 2 * self._gamma ** k / (self._gamma + 1)
+        values[0] = 0.0
+        return values
+
+    def add(self, groups, values):
+        """Add ``values`` to their ``groups``; NaN values are ignored."""
+        groups = np.asarray(groups, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        keep = ~np.isnan(values)
+        flat = groups[keep] * self.n_buckets + self.bucket(values[keep])
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        """Add the counts of a sketch with the same parameters."""
+        if other._params() != self._params():
+            raise ValueError('Cannot merge quantile sketches with different parameters')
+        self.counts += other.counts
+        return self
+
+    def count(self):
+        """Number of values per group."""
+        return self.counts.sum(axis=1)
+
+    def quantile(self, q):
+        """
+        ``q``-th percentile (0-100) per group, NaN for empty groups. Like
+        np.percentile, the values at the two ranks around q / 100 * (n - 1)
+        are interpolated linearly.
+        """
+        n = self.count()
+        position = q / 100 * np.maximum(n - 1, 0)
+        lower = np.floor(position)
+        upper = np.minimum(lower + 1, np.maximum(n - 1, 0))
+        cumulative = np.cumsum(self.counts, axis=1)
+        values = self.bucket_values()
+        low_value = values[np.argmax(cumulative > lower[:, None], axis=1)]
+        high_value = values[np.argmax(cumulative > upper[:, None], axis=1)]
+        result = low_value + (high_value - low_value) * (position - lower)
+        return np.where(n > 0, result, np.nan)
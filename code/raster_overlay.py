@@ -0,0 +1,124 @@
+"""
+Raster output for gridded maps (the KDE hotspot maps).
+
+Instead of one folium.Rectangle per grid cell, the normalized grid is
+colour-mapped into an RGBA image and added to the map either as a single
+PNG ImageOverlay embedded in the HTML, or as a pyramid of 256 px XYZ tiles
+written to disk and shown with a TileLayer. The image is resampled to Web
+Mercator rows (what Leaflet draws in) and capped at ``max_size`` pixels per
+side, so render time and file size no longer depend on the number of cells:
+
+    add_image_overlay(m_start, kde_start_norm, lng_grid, lat_grid)
+    # or
+    write_tiles(kde_start_norm, lng_grid, lat_grid, 'sf_start_tiles', zooms=range(11, 16))
+    add_tile_layer(m_start, 'sf_start_tiles')
+
+Cell (j, i) covers lat_grid[j]..lat_grid[j + 1] and lng_grid[i]..lng_grid[i + 1]
+and has the value ``values[j, i]``, like the rectangles it replaces. The
+colour is ``color`` with opacity intensity^2 (the rectangle fill colour and
+fill opacity were both the intensity); cells with intensity 0 are
+transparent.
+"""
+import os
+
+import folium
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+
+
+def mercator_y(lat):
+    """Web Mercator y (radians scale) of a latitude in degrees."""
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    return np.log(np.tan(np.pi / 4 + lat / 2))
+
+
+def inverse_mercator_y(y):
+    """Latitude in degrees of a Web Mercator y."""
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+def colorize(values, color=(255, 0, 0)):
+    """RGBA uint8 image of ``values`` in [0, 1]: ``color`` with alpha values^2, NaN transparent."""
+    values = np.nan_to_num(np.clip(values, 0, 1), nan=0.0)
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = color
+    rgba[..., 3] = np.round(values ** 2 * 255).astype(np.uint8)
+    return rgba
+
+
+def sample_cells(values, lon_grid, lat_grid, lon, lat):
+    """Value of the cell containing each (lon, lat), NaN outside the grid."""
+    i = np.floor((lon - lon_grid[0]) / (lon_grid[1] - lon_grid[0])).astype(np.int64)
+    j = np.floor((lat - lat_grid[0]) / (lat_grid[1] - lat_grid[0])).astype(np.int64)
+    inside = (i >= 0) & (i < len(lon_grid) - 1) & (j >= 0) & (j < len(lat_grid) - 1)
+    result = np.full(np.broadcast(lon, lat).shape, np.nan)
+    i, j, inside = np.broadcast_arrays(i, j, inside)
+    result[inside] = values[j[inside], i[inside]]
+    return result
+
+
+def render_image(values, lon_grid, lat_grid, max_size=1024, color=(255, 0, 0)):
+    """
+    RGBA image (north up) of the grid resampled to evenly spaced Web Mercator
+    rows, at most ``max_size`` pixels per side, and its bounds
+    [[lat_min, lon_min], [lat_max, lon_max]].
+    """
+    n_cols, n_rows = len(lon_grid) - 1, len(lat_grid) - 1
+    scale = min(1.0, max_size / max(n_cols, n_rows))
+    width, height = max(1, int(round(n_cols * scale))), max(1, int(round(n_rows * scale)))
+
+    lon = lon_grid[0] + (np.arange(width) + 0.5) * (lon_grid[-1] - lon_grid[0]) / width
+    y_top, y_bottom = mercator_y(lat_grid[-1]), mercator_y(lat_grid[0])
+    lat = inverse_mercator_y(y_top + (np.arange(height) + 0.5) * (y_bottom - y_top) / height)
+    image = colorize(sample_cells(values, lon_grid, lat_grid, lon[None, :], lat[:, None]), color)
+    bounds = [[lat_grid[0], lon_grid[0]], [lat_grid[-1], lon_grid[-1]]]
+    return image, bounds
+
+
+def add_image_overlay(m, values, lon_grid, lat_grid, max_size=1024, color=(255, 0, 0), name=None):
+    """Add the grid to the folium map ``m`` as one embedded PNG ImageOverlay."""
+    image, bounds = render_image(values, lon_grid, lat_grid, max_size, color)
+    return folium.raster_layers.ImageOverlay(image, bounds=bounds, origin='upper', name=name).add_to(m)
+
+
+def tile_range(lon_min, lat_min, lon_max, lat_max, zoom):
+    """(x_min, x_max, y_min, y_max) of the XYZ tiles covering the box at ``zoom``."""
+    n = 2 ** zoom
+    x = lambda lon: int(np.clip(np.floor((lon + 180) / 360 * n), 0, n - 1))
+    y = lambda lat: int(np.clip(np.floor((1 - mercator_y(lat) / np.pi) / 2 * n), 0, n - 1))
+    return x(lon_min), x(lon_max), y(lat_max), y(lat_min)
+
+
+def write_tiles(values, lon_grid, lat_grid, out_dir, zooms=range(10, 16), color=(255, 0, 0)):
+    """
+    Write the grid as 256 px PNG tiles <out_dir>/<z>/<x>/<y>.png for every
+    zoom in ``zooms``. Tiles without any coloured pixel are skipped.
+    Returns the number of tiles written.
+    """
+    n_written = 0
+    pixel = np.arange(TILE_SIZE) + 0.5
+    for zoom in zooms:
+        n = 2 ** zoom
+        x_min, x_max, y_min, y_max = tile_range(lon_grid[0], lat_grid[0], lon_grid[-1], lat_grid[-1], zoom)
+        for tx in range(x_min, x_max + 1):
+            lon = (tx + pixel / TILE_SIZE) / n * 360 - 180
+            for ty in range(y_min, y_max + 1):
+                lat = inverse_mercator_y(np.pi * (1 - 2 * (ty + pixel / TILE_SIZE) / n))
+                image = colorize(sample_cells(values, lon_grid, lat_grid, lon[None, :], lat[:, None]), color)
+                if not image[..., 3].any():
+                    continue
+                tile_dir = os.path.join(out_dir, str(zoom), str(tx))
+                os.makedirs(tile_dir, exist_ok=True)
+                Image.fromarray(image).save(os.path.join(tile_dir, f'{ty}.png'), optimize=True)
+                n_written += 1
+    return n_written
+
+
+def add_tile_layer(m, tile_dir, name=None, min_zoom=0, max_zoom=18):
+    """Add tiles written by write_tiles (path relative to the HTML file) to the map ``m``."""
+    url = tile_dir.replace(os.sep, '/').rstrip('/') + '/{z}/{x}/{y}.png'
+    return folium.raster_layers.TileLayer(tiles=url, attr='KDE', name=name, overlay=True,
+                                          min_zoom=min_zoom, max_zoom=max_zoom).add_to(m)
@@ -0,0 +1,191 @@
+"""
+What-if scenarios: demand change when stations or facilities are added or removed.
+
+A ScenarioEngine loads the city grid (grid_with_counts), its spatial index
+and a fitted demand model (see demand_scoring.py) once. An edit is the
+geometry of one metro station, bus stop or bike lane segment to add or
+remove; only the cells the geometry intersects are looked up in the spatial
+index, their feature columns are updated the way grid_features.py computes
+them (count layers: +-1 per intersecting feature, length layers: +- the
+length clipped to the cell, in the same metric CRS) and only those cells are
+scored again. The cost of a scenario thus grows with the edit, not with the
+city:
+
+    engine = ScenarioEngine('Shanghai', model='Random Forest')
+    delta = engine.apply([
+        {'action': 'add', 'kind': 'station', 'geometry': (121.47, 31.23)},
+        {'action': 'add', 'kind': 'bike_lane', 'geometry': [(121.46, 31.22), (121.48, 31.22)]},
+    ])
+    delta      # GeoDataFrame of the touched cells: old / new features, start_count and end_count
+               # before and after, and their change (start_delta, end_delta)
+
+Geometries are in WGS84: a (lon, lat) pair, a list of pairs (line), a
+GeoJSON geometry dict or a Shapely geometry. With ``commit=True`` the edits
+stay in the engine, so later scenarios build on them.
+
+From the command line (from the repository root), one ACTION:KIND:COORDS
+string per edit, so negative longitudes are not taken for options:
+    python code/scenario.py Shanghai --edit add:station:121.47,31.23 \\
+        --edit remove:bus_stop:121.45,31.21 --edit "add:bike_lane:121.46,31.22 121.48,31.22" \\
+        --output data/Shanghai/scenario_delta.geojson
+    python code/scenario.py SanFrancisco --edit add:station:-122.42,37.77
+"""
+import argparse
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+from cities import get_city
+from demand_scoring import DEFAULT_MODEL, DemandScorer
+from grid_features import METRIC_CRS
+from grid_io import read_grid
+
+ACTIONS = ('add', 'remove')
+# 编辑类型 -> cities.py 中对应的图层名称
+EDIT_LAYERS = {'station': 'railway', 'bus_stop': 'bus', 'bike_lane': 'bicyclelane'}
+
+
+def to_geometry(geometry):
+    """Shapely geometry (WGS84) from a (lon, lat) pair, a list of pairs, a GeoJSON dict or a geometry."""
+    if isinstance(geometry, shapely.Geometry):
+        return geometry
+    if isinstance(geometry, dict):
+        return shape(geometry)
+    coords = np.asarray(geometry, dtype=np.float64)
+    if coords.ndim == 1:
+        return shapely.Point(coords)
+    return shapely.LineString(coords)
+
+
+def parse_coords(text):
+    """'lon,lat' or 'lon,lat lon,lat ...' as a list of (lon, lat) pairs (a single pair for one point)."""
+    pairs = [tuple(float(v) for v in pair.split(',')) for pair in text.split()]
+    return pairs[0] if len(pairs) == 1 else pairs
+
+
+def parse_edit(text):
+    """Edit dict from 'ACTION:KIND:COORDS', e.g. 'add:station:-122.42,37.77' (COORDS as in parse_coords)."""
+    parts = text.split(':', 2)
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError(f"expected ACTION:KIND:COORDS, got '{text}'")
+    action, kind, coords = parts
+    pairs = coords.split()
+    try:
+        if not pairs or any(len(pair.split(',')) != 2 for pair in pairs):
+            raise ValueError(coords)
+        geometry = parse_coords(coords)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected 'lon,lat' or 'lon,lat lon,lat ...' coordinates, got '{coords}'")
+    return {'action': action, 'kind': kind, 'geometry': geometry}
+
+
+class ScenarioEngine:
+    """Incremental feature update and rescoring of the grid of ``city``."""
+
+    def __init__(self, city, model=DEFAULT_MODEL, model_dir=None, grid_path=None):
+        config = get_city(city)
+        self.layers = {layer['name']: layer for layer in config['layers']}
+        grid = read_grid(grid_path or os.path.join(config['data_dir'], 'grid_with_counts'))
+        self.cells = grid.geometry.to_crs(epsg=METRIC_CRS).reset_index(drop=True)
+        self.features = pd.DataFrame(grid.drop(columns='geometry')).reset_index(drop=True)
+        self.scorer = DemandScorer(model_dir or os.path.join(config['data_dir'], 'models'), model)
+        # 建立一次空间索引，之后每次编辑只查询相交的网格
+        self.sindex = self.cells.sindex
+
+    def _layer(self, kind):
+        if kind not in EDIT_LAYERS:
+            raise ValueError(f"Unknown edit kind '{kind}', expected one of {list(EDIT_LAYERS)}")
+        layer = self.layers[EDIT_LAYERS[kind]]
+        if layer['column'] not in self.features:
+            raise ValueError(f"Grid has no column '{layer['column']}' for {kind} edits")
+        return layer
+
+    def feature_changes(self, edits):
+        """(cells, column -> change per cell) of the feature columns touched by ``edits``."""
+        cell_parts, column_parts, value_parts = [], [], []
+        for edit in edits:
+            if edit['action'] not in ACTIONS:
+                raise ValueError(f"Unknown edit action '{edit['action']}', expected one of {ACTIONS}")
+            layer = self._layer(edit['kind'])
+            geometry = gpd.GeoSeries([to_geometry(edit['geometry'])], crs=4326).to_crs(epsg=METRIC_CRS).iloc[0]
+            cells = self.sindex.query(geometry, predicate='intersects')
+            if layer['kind'] == 'count':
+                values = np.ones(len(cells))
+            else:
+                values = shapely.length(shapely.intersection(geometry, self.cells.values[cells]))
+            sign = 1 if edit['action'] == 'add' else -1
+            cell_parts.append(cells)
+            column_parts.append(np.full(len(cells), layer['column'], dtype=object))
+            value_parts.append(sign * values)
+        if not cell_parts:
+            return np.empty(0, dtype=np.intp), {}
+        changes = pd.DataFrame({'cell': np.concatenate(cell_parts), 'column': np.concatenate(column_parts),
+                                'value': np.concatenate(value_parts)})
+        table = changes.pivot_table(index='cell', columns='column', values='value', aggfunc='sum', fill_value=0)
+        return table.index.to_numpy(), {column: table[column].to_numpy() for column in table.columns}
+
+    def apply(self, edits, commit=False):
+        """
+        Demand change of the cells touched by ``edits``, as a GeoDataFrame in
+        WGS84. Counts and lengths are not reduced below 0 by removals.
+        """
+        cells, changes = self.feature_changes(edits)
+        before = self.features.iloc[cells]
+        after = before.copy()
+        for column, change in changes.items():
+            after[column] = np.maximum(before[column].to_numpy() + change, 0).astype(before[column].dtype)
+
+        if len(cells) == 0:
+            # 编辑不在网格范围内
+            old = new = pd.DataFrame(columns=self.scorer.targets, dtype=np.float64)
+        else:
+            # 编辑前后的网格一起预测，只调用一次模型
+            scores = self.scorer.predict(pd.concat([before, after], ignore_index=True))
+            old = scores.iloc[:len(cells)].set_axis(before.index)
+            new = scores.iloc[len(cells):].set_axis(before.index)
+        delta = pd.DataFrame({'cell': cells}, index=before.index)
+        for column in changes:
+            delta[f'{column}_before'] = before[column]
+            delta[f'{column}_after'] = after[column]
+        for target, short in zip(self.scorer.targets, ('start', 'end')):
+            delta[f'{target}_before'] = old[target]
+            delta[f'{target}_after'] = new[target]
+            delta[f'{short}_delta'] = new[target] - old[target]
+        if commit:
+            self.features.loc[after.index, after.columns] = after
+        return gpd.GeoDataFrame(delta.reset_index(drop=True), geometry=self.cells.values[cells],
+                                crs=self.cells.crs).to_crs(epsg=4326)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Demand change when stations or facilities are added or removed.')
+    parser.add_argument('city', help='SanFrancisco or Shanghai')
+    parser.add_argument('--edit', type=parse_edit, action='append', required=True, metavar='ACTION:KIND:COORDS',
+                        help="add/remove, station/bus_stop/bike_lane and 'lon,lat' or 'lon,lat lon,lat ...', "
+                             "e.g. add:station:-122.42,37.77")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='fitted model to score with')
+    parser.add_argument('--model-dir', help='directory written by demand_models.py (default: <data_dir>/models)')
+    parser.add_argument('--grid', help='grid artifact (default: <data_dir>/grid_with_counts)')
+    parser.add_argument('--output', help='write the delta map to this GeoJSON file')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    engine = ScenarioEngine(args.city, args.model, args.model_dir, args.grid)
+    t1 = time.perf_counter()
+    delta = engine.apply(args.edit)
+    t2 = time.perf_counter()
+    print(delta.drop(columns='geometry').to_string(index=False))
+    print(f"total change: start_count {delta['start_delta'].sum():+.2f}, end_count {delta['end_delta'].sum():+.2f}")
+    print(f"engine loaded in {t1 - t0:.2f} s, {len(delta)} cells updated in {(t2 - t1) * 1000:.1f} ms")
+    if args.output:
+        delta.to_file(args.output, driver='GeoJSON')
+        print(f"Delta map saved to '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Spatial block cross-validation of the grid demand models.
+
+Neighbouring cells have similar features and counts, so a random
+train/test split of the cells rates the models too well. Here the cells are
+grouped into square blocks of whole cells, at least ``block_m`` metres wide,
+from their grid row and column, and whole blocks are assigned to the folds,
+so training and test cells only touch along block borders.
+
+The grid_with_bike_counts artifacts keep only the non-empty cells and carry
+no grid parameters, so row and column are inferred from the cell bounds: the
+cells are squares in the metric CRS they were built in (see
+grid_features.py), so the offset of each cell's lower-left corner from the
+grid's, divided by the cell size, gives its row and column. Blocks and
+folds are computed once per grid; a fold is a pair of row-index arrays into
+one feature matrix, so no table is copied per fold. All (grid, model,
+target, fold) fits of a run are spread over a process pool, and the scores
+of every grid go into one table:
+
+    grids = find_grids('data')       # SanFrancisco, Shanghai, 1.5km_Shanghai, ...
+    folds, metrics = spatial_cv(grids, block_m=6000, n_splits=5)
+
+From the command line (from the repository root):
+    python code/spatial_cv.py --block 6000 --folds 5 --scale --jobs 4
+writes data/spatial_cv.csv (mean over the folds) and
+data/spatial_cv_folds.csv (one row per fold).
+"""
+import argparse
+import glob
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error, r2_score
+
+from demand_models import MODELS, TARGETS, make_model, split_features
+from grid_features import METRIC_CRS
+from grid_io import FORMATS, read_features, read_grid
+
+# 工作进程中的数据集：名称 -> (特征矩阵, 目标矩阵, 每个网格所属的 fold)
+_datasets = None
+
+
+def find_grids(root='data', name='grid_with_bike_counts'):
+    """Grid artifacts ``name`` in the subfolders of ``root``, keyed by folder name."""
+    grids = {}
+    for folder in sorted(glob.glob(os.path.join(root, '*'))):
+        path = os.path.join(folder, name)
+        if any(os.path.exists(f'{path}.{fmt}') for fmt in FORMATS):
+            grids[os.path.basename(folder)] = path
+    return grids
+
+
+def cell_rowcol(path):
+    """
+    (row, col, cell_size) of every cell of a grid artifact of square cells,
+    inferred from the cell bounds in METRIC_CRS; cell_size in metres.
+    """
+    geometry = read_grid(path, columns=[]).geometry
+    # 由投影后的正方形网格的外包框推算行列号
+    minx, miny, maxx, _ = geometry.to_crs(METRIC_CRS).bounds.to_numpy().T
+    cell_size = float(np.median(maxx - minx))
+    row = np.rint((miny - miny.min()) / cell_size).astype(np.int64)
+    col = np.rint((minx - minx.min()) / cell_size).astype(np.int64)
+    return row, col, cell_size
+
+
+def block_ids(row, col, cells_per_block):
+    """Block number of every cell, blocks of cells_per_block x cells_per_block cells."""
+    block_row = np.asarray(row) // cells_per_block
+    block_col = np.asarray(col) // cells_per_block
+    return np.unique(block_col * (block_row.max() + 1) + block_row, return_inverse=True)[1]
+
+
+def block_folds(blocks, n_splits=5, random_state=42):
+    """
+    Fold of every cell: the blocks are shuffled and each one goes to the fold
+    with the fewest cells so far, so the folds have similar sizes.
+    """
+    sizes = np.bincount(blocks)
+    order = np.random.default_rng(random_state).permutation(len(sizes))
+    fold_of_block = np.empty(len(sizes), dtype=np.int32)
+    fold_sizes = np.zeros(n_splits, dtype=np.int64)
+    for block in order[np.argsort(-sizes[order], kind='stable')]:
+        fold = int(np.argmin(fold_sizes))
+        fold_of_block[block] = fold
+        fold_sizes[fold] += sizes[block]
+    return fold_of_block[blocks]
+
+
+def fold_indices(folds, k):
+    """Train and test row positions of fold ``k``."""
+    return np.flatnonzero(folds != k), np.flatnonzero(folds == k)
+
+
+def _init_worker(datasets):
+    global _datasets
+    _datasets = datasets
+
+
+def _fit_fold(dataset, name, target, k, scale):
+    features, targets, folds = _datasets[dataset]
+    train, test = fold_indices(folds, k)
+    model = make_model(name, scale)
+    t0 = time.perf_counter()
+    model.fit(features[train], targets[train, target])
+    fit_seconds = time.perf_counter() - t0
+    y_pred = model.predict(features[test])
+    return {'mse': mean_squared_error(targets[test, target], y_pred),
+            'r2': r2_score(targets[test, target], y_pred),
+            'train_cells': len(train), 'test_cells': len(test), 'fit_seconds': fit_seconds}
+
+
+def spatial_cv(grids, models=None, targets=TARGETS, block_m=6000, n_splits=5, scale=False,
+               random_state=42, n_jobs=None):
+    """
+    Spatial block CV of every model on every grid in ``grids`` (name -> grid
+    artifact path). Returns (folds, metrics): one row per grid, model, target
+    and fold, and the mean and std over the folds per grid, model and target.
+    """
+    models = list(models or MODELS)
+    targets = list(targets)
+    datasets, info = {}, {}
+    for dataset, path in grids.items():
+        features, target_values = split_features(read_features(path), targets)
+        row, col, cell_size = cell_rowcol(path)
+        blocks = block_ids(row, col, max(1, math.ceil(block_m / cell_size - 1e-6)))
+        datasets[dataset] = (features.to_numpy(dtype=np.float64), target_values.to_numpy(dtype=np.float64),
+                             block_folds(blocks, n_splits, random_state))
+        info[dataset] = {'cell_size': cell_size, 'cells': len(blocks), 'blocks': int(blocks.max()) + 1}
+
+    tasks = [(dataset, name, t, k, scale) for dataset in datasets for name in models
+             for t in range(len(targets)) for k in range(n_splits)]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(tasks))
+    rows = {}
+    if n_jobs == 1:
+        _init_worker(datasets)
+        for task in tasks:
+            rows[task] = _fit_fold(*task)
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(datasets,)) as pool:
+            futures = {pool.submit(_fit_fold, *task): task for task in tasks}
+            for future in as_completed(futures):
+                rows[futures[future]] = future.result()
+
+    folds = pd.DataFrame([{'grid': task[0], 'model': task[1], 'target': targets[task[2]], 'fold': task[3],
+                           **rows[task]} for task in tasks])
+    metrics = (folds.groupby(['grid', 'model', 'target'], sort=False)
+               .agg(mse=('mse', 'mean'), mse_std=('mse', 'std'), r2=('r2', 'mean'), r2_std=('r2', 'std'),
+                    fit_seconds=('fit_seconds', 'sum'))
+               .reset_index())
+    info = pd.DataFrame.from_dict(info, orient='index').rename_axis('grid').reset_index()
+    return folds, info.merge(metrics, on='grid')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spatial block cross-validation of the demand models on all grids.')
+    parser.add_argument('--root', default='data', help='directory whose subfolders hold the grids')
+    parser.add_argument('--grids', nargs='+', help='grid folders to use (default: all with grid_with_bike_counts)')
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), help='models (default: all)')
+    parser.add_argument('--block', type=float, default=6000, help='block size in metres')
+    parser.add_argument('--folds', type=int, default=5, help='number of folds')
+    parser.add_argument('--scale', action='store_true', help='standardize the features (per fold)')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', help='metrics CSV (default: <root>/spatial_cv.csv); '
+                                         'the per-fold scores go to <output>_folds.csv')
+    args = parser.parse_args()
+
+    grids = find_grids(args.root)
+    if args.grids:
+        grids = {name: grids[name] for name in args.grids}
+    t0 = time.perf_counter()
+    folds, metrics = spatial_cv(grids, args.models, block_m=args.block, n_splits=args.folds,
+                                scale=args.scale, n_jobs=args.jobs)
+    print(metrics.to_string(index=False))
+    print(f"{len(folds)} fold fits on {len(grids)} grids in {time.perf_counter() - t0:.1f} s")
+
+    output = args.output or os.path.join(args.root, 'spatial_cv.csv')
+    metrics.to_csv(output, index=False)
+    folds.to_csv(f'{os.path.splitext(output)[0]}_folds.csv', index=False)
+    print(f"Metrics saved to '{output}'")
+
+
+if __name__ == '__main__':
+    main()
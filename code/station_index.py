@@ -0,0 +1,253 @@
+"""
+Precomputed nearest-station index of the OD points.
+
+For every trip the ``k`` nearest stations of its start and of its end point
+are looked up once in a KD-tree over the stations (city metric CRS, metres)
+and stored as an OD store (see od_store.py) inside the trip store the trips
+come from:
+
+    start_station, end_station      (trips, k) int32, station index, nearest first
+    start_distance, end_distance    (trips, k) float32, metres
+
+A point with a missing coordinate (the trip store keeps trips with one
+complete point) has station -1 and distance inf, so it falls outside every
+radius and each point of a trip is counted on its own.
+
+The ratio, ring density and catchment analyses then become group-bys over
+these arrays, without any spatial query:
+
+    index = load_station_index('Shanghai', radius_m=1500)
+    nearest, distance = index.nearest()                        # all OD points
+    counts = within_counts(np.sort(distance), [150, 1000])     # station_ratio.py
+    rings = index.ring_counts(ring_edges(100, 1500))           # ring_density.py
+    station, trip, distance_m = index.pairs_within(150)        # catchment.py
+
+A point can only be matched to its ``k`` nearest stations, so queries up to a
+radius r are exact as long as the k-th nearest station of every point is
+farther than r. With ``radius_m`` k is derived from the data: the largest
+number of stations within radius_m of any OD point, plus one. An index
+already stored for the same trips and stations that is exact beyond
+radius_m is reused. Without it k defaults to DEFAULT_K, enough for
+nearest(); pairs_within and ring_counts raise beyond the exact radius.
+Distances are planar in the metric CRS, so a few pairs right at the radius
+can differ from the haversine test of catchment.py.
+The index is rebuilt when the trip store, the station file, k or the CRS
+change. Build it from the command line (from the repository root):
+    python code/station_index.py Shanghai --radius 1500
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from cities import get_city
+from coords import project, station_coords
+from od_store import ODStore, is_store, write_store
+from trip_loader import complete_points, trip_store
+
+ENDPOINTS = ('start', 'end')
+DEFAULT_K = 8
+# 修改索引格式时递增，使旧的索引失效
+INDEX_VERSION = 3
+
+
+def nearest_stations(points_xy, station_xy, k):
+    """(stations, distances) of the ``k`` nearest stations of every point, both (points, k)."""
+    k = min(k, len(station_xy))
+    distance, station = cKDTree(station_xy).query(points_xy, k=k)
+    if k == 1:
+        distance, station = distance[:, None], station[:, None]
+    return station.astype(np.int32), distance.astype(np.float32)
+
+
+def required_k(points_xy, station_xy, radius_m):
+    """Smallest k for which the k-th nearest station of every point is farther than ``radius_m``."""
+    # 距离以 float32 保存，半径稍微放大，避免舍入后第 k 近的距离等于半径
+    within = cKDTree(station_xy).query_ball_point(points_xy, radius_m * (1 + 1e-6), return_length=True)
+    return int(within.max(initial=0)) + 1
+
+
+def build_index(trips, station_xy, crs, k=None, radius_m=None):
+    """
+    Index columns for the trip table ``trips`` (start_lng, start_lat, end_lng,
+    end_lat): the ``k`` nearest stations of every point, with k large enough
+    to be exact up to ``radius_m`` if given (DEFAULT_K if neither is).
+    """
+    # 缺失坐标的点（行程另一端完整）不查询，站点记为 -1、距离记为 inf
+    valid = dict(zip(ENDPOINTS, complete_points(trips)))
+    points = {endpoint: project(np.asarray(trips[f'{endpoint}_lng'])[valid[endpoint]],
+                                np.asarray(trips[f'{endpoint}_lat'])[valid[endpoint]], crs) for endpoint in ENDPOINTS}
+    if radius_m is not None:
+        k = max(k or 1, *(required_k(points_xy, station_xy, radius_m) for points_xy in points.values()))
+    k = min(k or DEFAULT_K, len(station_xy))
+    columns = {}
+    for endpoint, points_xy in points.items():
+        station = np.full((len(valid[endpoint]), k), -1, dtype=np.int32)
+        distance = np.full((len(valid[endpoint]), k), np.inf, dtype=np.float32)
+        station[valid[endpoint]], distance[valid[endpoint]] = nearest_stations(points_xy, station_xy, k)
+        columns[f'{endpoint}_station'], columns[f'{endpoint}_distance'] = station, distance
+    return columns
+
+
+def _station_hash(station_path):
+    with open(station_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _index_dir(store_dir, station_hash, crs, spec):
+    key = json.dumps([station_hash, str(crs), spec, INDEX_VERSION])
+    return os.path.join(store_dir, f'station_index_{hashlib.sha256(key.encode()).hexdigest()[:16]}')
+
+
+def _exact_radius(columns, n_stations):
+    k = columns['start_station'].shape[1]
+    if k >= n_stations:
+        return np.inf
+    return float(min(columns[f'{endpoint}_distance'][:, -1].min(initial=np.inf) for endpoint in ENDPOINTS))
+
+
+def _stored_indexes(store_dir, station_hash, crs):
+    """StationIndexes already stored in ``store_dir`` for these stations and CRS."""
+    for name in sorted(os.listdir(store_dir)):
+        path = os.path.join(store_dir, name)
+        if not (name.startswith('station_index_') and is_store(path)):
+            continue
+        meta = ODStore(path).meta
+        if (meta.get('version') == INDEX_VERSION and meta.get('station_hash') == station_hash
+                and meta.get('crs') == str(crs)):
+            yield StationIndex(path)
+
+
+def load_station_index(city, k=None, filter_bbox=False, path=None, radius_m=None):
+    """
+    StationIndex over the trips of ``city`` (as loaded by load_trips), built
+    and stored next to the cached trips on first use. With ``radius_m`` the
+    index is exact up to that radius (k derived from the data, at least
+    ``k``); else it holds ``k`` (default DEFAULT_K) stations per point.
+    """
+    config = get_city(city)
+    crs = config['metric_crs']
+    station_path = os.path.join(config['data_dir'], config['station_file'])
+    store_dir = trip_store(city, filter_bbox, path)
+    station_hash = _station_hash(station_path)
+    if radius_m is not None:
+        # 已有的索引在该半径内精确时直接使用，取 k 最小的一个
+        usable = [index for index in _stored_indexes(store_dir, station_hash, crs)
+                  if index.exact_radius() > radius_m and (k is None or index.k >= k)]
+        if usable:
+            return min(usable, key=lambda index: index.k)
+        spec = {'radius_m': float(radius_m), 'k': k}
+    else:
+        spec = {'k': int(k or DEFAULT_K)}
+    index_dir = _index_dir(store_dir, station_hash, crs, spec)
+    if not is_store(index_dir):
+        station_xy = station_coords(station_path, crs)
+        columns = build_index(ODStore(store_dir), station_xy, crs, **spec)
+        exact = _exact_radius(columns, len(station_xy))
+        write_store(index_dir, columns, meta={'city': city, 'stations': station_path, 'station_hash': station_hash,
+                                              'n_stations': len(station_xy), 'crs': str(crs),
+                                              'k': int(columns['start_station'].shape[1]),
+                                              'exact_radius': None if np.isinf(exact) else exact,
+                                              'trips': store_dir, 'version': INDEX_VERSION})
+    return StationIndex(index_dir)
+
+
+class StationIndex:
+    """Memory-mapped nearest-station index written by load_station_index."""
+
+    def __init__(self, path):
+        self.store = ODStore(path)
+        self.n_stations = self.store.meta['n_stations']
+        self.k = self.store['start_station'].shape[1]
+
+    def __len__(self):
+        return len(self.store)
+
+    def stations(self, endpoint):
+        """(trips, k) nearest stations of the ``endpoint`` ('start' or 'end') points."""
+        return self.store[f'{endpoint}_station']
+
+    def distances(self, endpoint):
+        """(trips, k) distances (m) to the nearest stations of the ``endpoint`` points."""
+        return self.store[f'{endpoint}_distance']
+
+    def nearest(self, endpoints=ENDPOINTS):
+        """
+        Nearest station and its distance (m) of every point, ``endpoints``
+        stacked (-1 and inf for points with a missing coordinate).
+        """
+        station = np.concatenate([self.stations(endpoint)[:, 0] for endpoint in endpoints])
+        distance = np.concatenate([self.distances(endpoint)[:, 0] for endpoint in endpoints])
+        return station, distance
+
+    def exact_radius(self):
+        """Largest radius (m) up to which every point's stations are all in the index."""
+        exact = self.store.meta.get('exact_radius')
+        return np.inf if exact is None else exact
+
+    def _check_radius(self, radius_m):
+        # 第 k 近的站点也在半径内时，可能还有更远的站点没有存下来
+        if radius_m >= self.exact_radius():
+            raise ValueError(f"Station index with k={self.k} is only exact below {self.exact_radius():.0f} m, "
+                             f"got radius {radius_m:g} m; load it with load_station_index(..., radius_m={radius_m:g})")
+
+    def pairs_within(self, radius_m, endpoints=ENDPOINTS):
+        """
+        (station, trip, distance_m) of the trips with a point within
+        ``radius_m`` of the station, one row per pair with the distance of the
+        trip's nearer point, sorted by station and trip.
+        """
+        self._check_radius(radius_m)
+        stations, trips, distances = [], [], []
+        for endpoint in endpoints:
+            distance = self.distances(endpoint)
+            trip, rank = np.nonzero(distance <= radius_m)
+            stations.append(self.stations(endpoint)[trip, rank])
+            trips.append(trip)
+            distances.append(distance[trip, rank])
+        station, trip, distance = np.concatenate(stations), np.concatenate(trips), np.concatenate(distances)
+        # 起点和终点都在同一站点附近的行程只保留较近的一个
+        order = np.lexsort((distance, trip, station))
+        station, trip, distance = station[order], trip[order], distance[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (station[1:] != station[:-1]) | (trip[1:] != trip[:-1])
+        return station[first].astype(np.int64), trip[first].astype(np.int64), distance[first]
+
+    def ring_counts(self, edges_m, endpoints=ENDPOINTS):
+        """
+        Points per station and ring as a (stations, rings) array, with the
+        rings of ring_density.py (edges[k] < d <= edges[k + 1]).
+        """
+        edges = np.asarray(edges_m, dtype=np.float64)
+        self._check_radius(edges[-1])
+        counts = np.zeros(self.n_stations * (len(edges) - 1), dtype=np.int64)
+        for endpoint in endpoints:
+            distance = self.distances(endpoint)
+            trip, rank = np.nonzero(distance <= edges[-1])
+            ring = np.maximum(np.searchsorted(edges, distance[trip, rank], side='left') - 1, 0)
+            counts += np.bincount(self.stations(endpoint)[trip, rank] * (len(edges) - 1) + ring,
+                                  minlength=len(counts))
+        return counts.reshape(self.n_stations, len(edges) - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute the nearest stations of every OD point.')
+    parser.add_argument('city', help='SanFrancisco or Shanghai')
+    parser.add_argument('--radius', type=float, help='make the index exact up to this radius in metres')
+    parser.add_argument('--k', type=int, help=f'nearest stations stored per point (default: {DEFAULT_K}, '
+                                              'or as many as --radius needs)')
+    parser.add_argument('--bbox', action='store_true', help="only index trips inside the city's bbox")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = load_station_index(args.city, args.k, args.bbox, radius_m=args.radius)
+    print(f"Station index of {len(index)} trips (k={index.k}) at '{index.store.path}' "
+          f"in {time.perf_counter() - t0:.1f} s, exact up to {index.exact_radius():.0f} m")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Share of bike trip points near metro stations.
+
+Every OD point (trip start and end) has its nearest station and the
+distance to it in the precomputed station index (station_index.py, city
+metric CRS), so after the first run no spatial query is needed. Sorting
+those distances once answers "how many points lie within r of any station"
+for any set of radii with a binary search, and grouping by the nearest
+station splits the counts per station:
+
+    nearest, distance = load_station_index('Shanghai').nearest()
+    counts = within_counts(np.sort(distance), [150, 1000])
+    ratio = counts[0] / counts[1]
+
+Sweep from the command line (from the repository root):
+    python code/station_ratio.py Shanghai --radii 50 100 150 300 500 1000 --base 1000 --per-station
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from station_index import load_station_index
+
+
+def within_counts(sorted_distances, radii):
+    """Number of points within each radius, from ascending distances."""
+    return np.searchsorted(sorted_distances, np.asarray(radii, dtype=np.float64), side='right')
+
+
+def station_counts(distance, nearest, radii, n_stations):
+    """(stations, radii) counts of the points within each radius, by their nearest station."""
+    radii = np.asarray(radii, dtype=np.float64)
+    order = np.argsort(radii)
+    band = np.searchsorted(radii[order], distance, side='left')
+    keep = band < len(radii)
+    counts = np.bincount(nearest[keep] * len(radii) + band[keep], minlength=n_stations * len(radii))
+    cumulative = np.cumsum(counts.reshape(n_stations, len(radii)), axis=1)
+    result = np.empty_like(cumulative)
+    result[:, order] = cumulative
+    return result
+
+
+def ratio_table(city, radii, base_radius=1000, per_station=False, filter_bbox=False):
+    """
+    Points within each radius and their share of the points within
+    ``base_radius`` (in %). With ``per_station`` one row per station and
+    radius, attributing every point to its nearest station.
+    """
+    index = load_station_index(city, filter_bbox=filter_bbox)
+    nearest, distance = index.nearest()
+    n_stations = index.n_stations
+    radii = sorted(set(radii) | {base_radius})
+
+    if not per_station:
+        counts = within_counts(np.sort(distance), radii)
+        base = counts[radii.index(base_radius)]
+        return pd.DataFrame({'radius_m': radii, 'points': counts,
+                             'proportion': counts / base * 100 if base else np.nan})
+
+    counts = station_counts(distance, nearest, radii, n_stations)
+    base = counts[:, [radii.index(base_radius)]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportion = counts / base * 100
+    return pd.DataFrame({
+        'station': np.repeat(np.arange(n_stations), len(radii)) + 1,
+        'radius_m': np.tile(radii, n_stations),
+        'points': counts.ravel(),
+        'proportion': proportion.ravel(),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Share of OD points within given distances of metro stations.')
+    parser.add_argument('city', help='SanFrancisco or Shanghai')
+    parser.add_argument('--radii', type=float, nargs='+', default=[150, 1000], help='radii in metres')
+    parser.add_argument('--base', type=float, default=1000, help='radius the proportions are relative to')
+    parser.add_argument('--per-station', action='store_true', help='one row per nearest station and radius')
+    parser.add_argument('--bbox', action='store_true', help="only use trips inside the city's bbox")
+    parser.add_argument('--output', help='also write the table to this CSV')
+    args = parser.parse_args()
+
+    table = ratio_table(args.city, args.radii, args.base, args.per_station, args.bbox)
+    print(table.to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
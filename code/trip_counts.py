@@ -0,0 +1,65 @@
+"""
+Streaming trip counts per grid cell.
+
+Reads a trip CSV in chunks, keeping only the coordinate columns as float32,
+and bins the start and end points of each chunk into grid cells by cell id
+(see grid_index.py). On regular grids no Shapely geometries are created and
+memory stays bounded by the chunk size, so multi-month trip dumps can be
+counted in one pass.
+
+    index = open_grid_index('data/SanFrancisco/grid_with_counts.csv')
+    counts = stream_cell_counts('data/SanFrancisco/202008-baywheels-tripdata.csv', index,
+                                {'start': ('start_lng', 'start_lat'),
+                                 'end': ('end_lng', 'end_lat')})
+    counts['start']   # start_count per cell_id
+
+stream_store_counts does the same over the chunks of an OD store (see
+od_store.py), e.g. the cached canonical trip table of trip_loader.trip_store:
+
+    counts = stream_store_counts(trip_store('SanFrancisco', filter_bbox=False), index,
+                                 {'start': ('start_lng', 'start_lat'), 'end': ('end_lng', 'end_lat')})
+"""
+import numpy as np
+import pandas as pd
+
+from od_store import ODStore
+
+
+def read_coordinate_chunks(path, columns, chunksize=500_000, dtype=np.float32):
+    """Yield chunks of ``path`` holding only ``columns`` as ``dtype`` (float32 by default)."""
+    return pd.read_csv(path, usecols=columns, dtype={c: dtype for c in columns},
+                       chunksize=chunksize)
+
+
+def stream_cell_counts(path, index, points, chunksize=500_000):
+    """
+    Count trip points per cell of ``index`` (a GridIndex or ZoneIndex).
+
+    ``points`` maps a name to the (lon, lat) columns of one point of the trip,
+    e.g. {'start': ('start_lng', 'start_lat'), 'end': ('end_lng', 'end_lat')}.
+    Returns a dict with one int64 array of length len(index) per name. Points
+    with missing coordinates or outside the grid are not counted.
+    """
+    columns = list(dict.fromkeys(c for pair in points.values() for c in pair))
+    chunks = ({c: chunk[c].to_numpy() for c in columns} for chunk in read_coordinate_chunks(path, columns, chunksize))
+    return _count_chunks(chunks, index, points)
+
+
+def stream_store_counts(path, index, points, chunksize=500_000):
+    """
+    Count trip points per cell of ``index`` from the OD store at ``path``,
+    ``chunksize`` rows at a time. ``points`` maps a name to the (lon, lat)
+    columns of the store; the result is that of stream_cell_counts.
+    """
+    columns = list(dict.fromkeys(c for pair in points.values() for c in pair))
+    return _count_chunks(ODStore(path).iter_chunks(columns, chunksize), index, points)
+
+
+def _count_chunks(chunks, index, points):
+    counts = {name: np.zeros(len(index), dtype=np.int64) for name in points}
+    for chunk in chunks:
+        for name, (lon, lat) in points.items():
+            # 每个点单独判断缺失坐标，行程另一端缺失不影响这一端的计数
+            valid = ~(np.isnan(chunk[lon]) | np.isnan(chunk[lat]))
+            counts[name] += index.count(chunk[lon][valid], chunk[lat][valid])
+    return counts
@@ -0,0 +1,204 @@
+"""
+Shared loader for the bike trip data.
+
+Every city's trip CSV has its own column names (Bay Wheels: start_lng /
+start_lat / started_at ..., Mobike: start_location_x / start_location_y /
+start_time ...). The schema in cities.py maps them onto one canonical
+columnar table:
+
+    start_lng, start_lat, end_lng, end_lat    float32, degrees (WGS84)
+    start_time, end_time                      int64, seconds since 1970-01-01 UTC
+                                              (MISSING_TIME if absent or unparsable)
+    trip_id                                   optional: int64, or fixed-width bytes
+                                              for string ids
+
+With ``filter_bbox`` only trips whose start and end points both lie inside
+the city's ``bbox`` are kept. Without it the store keeps every trip with at
+least one complete point, the missing point as NaN, so per-point counts (trip
+counts per cell, nearest stations) still see the start of a trip without an
+end and vice versa. load_trips returns only complete trips unless asked with
+``complete=False``. The result is cached as an OD store (see od_store.py) under
+<data_dir>/trip_cache, keyed on the CSV's path, size and modification time,
+the schema and the box, and later loads memory-map those files instead of
+parsing the CSV:
+
+    trips = load_trips('SanFrancisco')                      # DataFrame, bbox-filtered
+    trips = load_trips('Shanghai', filter_bbox=False)       # all complete trips
+    trips['start_lng'], trips['start_time']
+
+A named store, e.g. to share between processes, is written with
+    python code/trip_loader.py SanFrancisco --output data/SanFrancisco/od_points --ids --arrow
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from cities import get_city
+from od_store import ODStore, is_store, write_store
+
+COORDINATES = ('start_lng', 'start_lat', 'end_lng', 'end_lat')
+TIMES = ('start_time', 'end_time')
+COLUMNS = COORDINATES + TIMES
+MISSING_TIME = np.iinfo(np.int64).min
+# 修改读取逻辑时递增，使旧的缓存失效
+LOADER_VERSION = 3
+
+
+def trip_schema(city):
+    """Canonical column -> CSV column for ``city`` (time and id columns may be None)."""
+    trips = get_city(city)['trips']
+    return {
+        'start_lng': trips['start'][0], 'start_lat': trips['start'][1],
+        'end_lng': trips['end'][0], 'end_lat': trips['end'][1],
+        'start_time': trips.get('start_time'), 'end_time': trips.get('end_time'),
+        'trip_id': trips.get('trip_id'),
+    }
+
+
+def in_bbox(lng, lat, bbox):
+    """Points inside bbox = (lng_min, lng_max, lat_min, lat_max)."""
+    lng_min, lng_max, lat_min, lat_max = bbox
+    return (lng >= lng_min) & (lng <= lng_max) & (lat >= lat_min) & (lat <= lat_max)
+
+
+def parse_times(values):
+    """Timestamps as int64 seconds since the epoch, MISSING_TIME where unparsable."""
+    times = pd.to_datetime(values, errors='coerce', format='mixed')
+    return times.to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+
+def fixed_width(values):
+    """Trip ids as int64 if they are integers, else as fixed-width bytes."""
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values):
+        return values.to_numpy(dtype=np.int64)
+    return values.astype(str).to_numpy().astype(np.bytes_)
+
+
+def read_trip_csv(path, schema, bbox=None, chunksize=500_000, with_ids=False):
+    """
+    Read ``path`` in chunks into the canonical columns (dict of arrays).
+    With ``bbox`` only complete trips inside it are kept, else every trip
+    with at least one complete point. With ``with_ids`` the trip id column
+    of the schema is read as well.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    source = {name: column for name, column in schema.items() if column is not None and column in header}
+    if not with_ids:
+        source.pop('trip_id', None)
+    elif 'trip_id' not in source:
+        raise ValueError(f"'{path}' has no trip id column (schema {schema})")
+    missing = [name for name in COORDINATES if name not in source]
+    if missing:
+        raise ValueError(f"'{path}' has no column for {missing} (schema {schema})")
+
+    parts = {name: [] for name in COLUMNS + (('trip_id',) if with_ids else ())}
+    dtypes = {source[name]: np.float32 for name in COORDINATES}
+    for chunk in pd.read_csv(path, usecols=list(dict.fromkeys(source.values())), dtype=dtypes,
+                             chunksize=chunksize):
+        coords = {name: chunk[source[name]].to_numpy() for name in COORDINATES}
+        start_ok, end_ok = complete_points(coords)
+        keep = start_ok & end_ok if bbox is not None else start_ok | end_ok
+        if bbox is not None:
+            keep &= in_bbox(coords['start_lng'], coords['start_lat'], bbox)
+            keep &= in_bbox(coords['end_lng'], coords['end_lat'], bbox)
+        for name in COORDINATES:
+            parts[name].append(coords[name][keep])
+        for name in TIMES:
+            if name in source:
+                parts[name].append(parse_times(chunk[source[name]].to_numpy()[keep]))
+            else:
+                parts[name].append(np.full(int(keep.sum()), MISSING_TIME, dtype=np.int64))
+        if with_ids:
+            parts['trip_id'].append(chunk[source['trip_id']].to_numpy()[keep])
+    if with_ids:
+        parts['trip_id'] = [fixed_width(np.concatenate(parts['trip_id']))] if parts['trip_id'] else []
+    return {name: np.concatenate(values) if values else
+            np.empty(0, dtype=np.float32 if name in COORDINATES else np.int64)
+            for name, values in parts.items()}
+
+
+def complete_points(trips):
+    """(start, end) masks of the trips whose start / end point has both coordinates."""
+    return tuple(~(np.isnan(np.asarray(trips[f'{endpoint}_lng'])) | np.isnan(np.asarray(trips[f'{endpoint}_lat'])))
+                 for endpoint in ('start', 'end'))
+
+
+def _cache_dir(path, schema, bbox, root):
+    stat = os.stat(path)
+    key = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime_ns, schema,
+                      None if bbox is None else [float(v) for v in bbox], LOADER_VERSION])
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(root, f'{stem}_{hashlib.sha256(key.encode()).hexdigest()[:16]}')
+
+
+def trip_store(city, filter_bbox=True, path=None):
+    """
+    Directory of the cached OD store holding the canonical trips of ``city``,
+    built from the CSV if it does not exist yet.
+    """
+    config = get_city(city)
+    path = path or os.path.join(config['data_dir'], config['trips']['file'])
+    schema = trip_schema(city)
+    bbox = config['trips']['bbox'] if filter_bbox else None
+    cache_dir = _cache_dir(path, schema, bbox, os.path.join(config['data_dir'], 'trip_cache'))
+    if not is_store(cache_dir):
+        write_store(cache_dir, read_trip_csv(path, schema, bbox), meta={'source': path, 'bbox': bbox})
+    return cache_dir
+
+
+def load_trips(city, filter_bbox=True, cache=True, path=None, complete=True):
+    """
+    Canonical trip table of ``city`` as a DataFrame backed by the (memory-mapped)
+    cache. ``path`` overrides the city's trip CSV. With ``complete=False``
+    trips with one missing point are kept as well (only without ``filter_bbox``).
+    """
+    if not cache:
+        config = get_city(city)
+        path = path or os.path.join(config['data_dir'], config['trips']['file'])
+        bbox = config['trips']['bbox'] if filter_bbox else None
+        trips = pd.DataFrame(read_trip_csv(path, trip_schema(city), bbox), copy=False)
+    else:
+        trips = ODStore(trip_store(city, filter_bbox, path)).to_frame()
+    if complete:
+        keep = np.logical_and(*complete_points(trips))
+        # 只有存在缺失点时才复制
+        if not keep.all():
+            trips = trips[keep].reset_index(drop=True)
+    return trips
+
+
+def convert_trips(city, output, filter_bbox=False, with_ids=False, formats=('npy',), path=None):
+    """Write the canonical trips of ``city`` as an OD store at ``output``."""
+    config = get_city(city)
+    path = path or os.path.join(config['data_dir'], config['trips']['file'])
+    bbox = config['trips']['bbox'] if filter_bbox else None
+    columns = read_trip_csv(path, trip_schema(city), bbox, with_ids=with_ids)
+    return write_store(output, columns, meta={'city': city, 'source': path, 'bbox': bbox}, formats=formats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a city trip CSV into a memory-mappable OD store.')
+    parser.add_argument('city', help='SanFrancisco or Shanghai')
+    parser.add_argument('--trips', help='trip CSV (default: the city trip file)')
+    parser.add_argument('--output', help='store directory (default: <data_dir>/od_points)')
+    parser.add_argument('--bbox', action='store_true', help="keep only trips inside the city's bbox")
+    parser.add_argument('--ids', action='store_true', help='also store the trip ids')
+    parser.add_argument('--arrow', action='store_true', help='also write an Arrow IPC file')
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(get_city(args.city)['data_dir'], 'od_points')
+    formats = ('npy', 'arrow') if args.arrow else ('npy',)
+    t0 = time.perf_counter()
+    store = convert_trips(args.city, output, args.bbox, args.ids, formats, args.trips)
+    print(f"{len(store)} trips ({', '.join(store.columns)}) written to '{output}' "
+          f"in {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
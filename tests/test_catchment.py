@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+from catchment import catchment_stats, haversine_km, station_trip_distances
+
+CRS = 'EPSG:32610'
+
+
+@pytest.fixture
+def trips():
+    rng = np.random.default_rng(0)
+    station_lon = rng.uniform(-122.45, -122.40, 12)
+    station_lat = rng.uniform(37.75, 37.80, 12)
+    # 一半的点落在站点附近，保证每个站点都有行程
+    n = 4000
+    near = rng.integers(0, len(station_lon), n)
+    clustered = rng.random(n) < 0.5
+    start_lon = np.where(clustered, station_lon[near] + rng.normal(0, 0.002, n), rng.uniform(-122.46, -122.39, n))
+    start_lat = np.where(clustered, station_lat[near] + rng.normal(0, 0.002, n), rng.uniform(37.74, 37.81, n))
+    end_lon = start_lon + rng.normal(0, 0.01, n)
+    end_lat = start_lat + rng.normal(0, 0.01, n)
+    # 一端缺失坐标的行程
+    start_lon[:50] = np.nan
+    end_lat[50:100] = np.nan
+    duration_min = rng.gamma(2, 6, n)
+    return station_lon, station_lat, [(start_lon, start_lat), (end_lon, end_lat)], duration_min
+
+
+def per_station_scan(station_lon, station_lat, points, values, radius_m):
+    """Row-wise station filtering of the original Dvalue scripts."""
+    (start_lon, start_lat), (end_lon, end_lat) = points
+    count, mean, p90 = [], [], []
+    for lon, lat in zip(station_lon, station_lat):
+        nearby = ((haversine_km(start_lat, start_lon, lat, lon) <= radius_m / 1000) |
+                  (haversine_km(end_lat, end_lon, lat, lon) <= radius_m / 1000))
+        count.append(nearby.sum())
+        mean.append(values[nearby].mean() if nearby.any() else np.nan)
+        p90.append(np.percentile(values[nearby], 90) if nearby.any() else np.nan)
+    return np.array(count), np.array(mean), np.array(p90)
+
+
+@pytest.mark.parametrize('radius_m', [150, 500])
+def test_catchment_stats_match_per_station_scan(trips, radius_m):
+    station_lon, station_lat, points, values = trips
+    stats = catchment_stats(station_lon, station_lat, points, values, radius_m, CRS)
+    count, mean, p90 = per_station_scan(station_lon, station_lat, points, values, radius_m)
+    assert count.min() > 0
+    np.testing.assert_array_equal(stats['count'], count)
+    np.testing.assert_allclose(stats['mean'], mean, equal_nan=True)
+    np.testing.assert_allclose(stats['p90'], p90, equal_nan=True)
+
+
+def test_station_blocks_do_not_change_pairs(trips):
+    station_lon, station_lat, points, _ = trips
+    expected = station_trip_distances(station_lon, station_lat, points, 300, CRS)
+    blocked = station_trip_distances(station_lon, station_lat, points, 300, CRS, station_block=5)
+    for a, b in zip(expected, blocked):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_pair_distance_is_that_of_the_nearer_point(trips):
+    station_lon, station_lat, points, _ = trips
+    (start_lon, start_lat), (end_lon, end_lat) = points
+    station, trip, distance = station_trip_distances(station_lon, station_lat, points, 300, CRS)
+    to_start = haversine_km(start_lat[trip], start_lon[trip], station_lat[station], station_lon[station])
+    to_end = haversine_km(end_lat[trip], end_lon[trip], station_lat[station], station_lon[station])
+    np.testing.assert_allclose(distance, np.fmin(to_start, to_end))
+    assert (distance <= 0.3).all()
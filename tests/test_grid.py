@@ -0,0 +1,89 @@
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import box
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+from grid import Grid
+from grid_features import aggregate_layer, create_grid
+
+BOUNDS = (-13630000.0, 4540000.0, -13625300.0, 4543700.0)
+
+
+def nested_loop_grid(gdf, cell_size=1000):
+    """create_grid of the original geodata scripts."""
+    xmin, ymin, xmax, ymax = gdf.total_bounds
+    grid_cells = []
+    x = xmin
+    while x < xmax:
+        y = ymin
+        while y < ymax:
+            grid_cells.append(box(x, y, x + cell_size, y + cell_size))
+            y += cell_size
+        x += cell_size
+    return gpd.GeoDataFrame({'geometry': grid_cells}, crs=gdf.crs)
+
+
+@pytest.fixture
+def layers():
+    rng = np.random.default_rng(0)
+    xmin, ymin, xmax, ymax = BOUNDS
+    x = rng.uniform(xmin, xmax, 200)
+    y = rng.uniform(ymin, ymax, 200)
+    points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs=3857)
+    starts = np.column_stack([rng.uniform(xmin, xmax, 40), rng.uniform(ymin, ymax, 40)])
+    ends = starts + rng.normal(0, 1500, (40, 2))
+    lines = gpd.GeoDataFrame(geometry=shapely.linestrings(np.stack([starts, ends], axis=1)), crs=3857)
+    centres = np.column_stack([rng.uniform(xmin, xmax, 30), rng.uniform(ymin, ymax, 30)])
+    areas = gpd.GeoDataFrame({'landuse': rng.choice(['residential', 'retail', None], 30)},
+                             geometry=shapely.buffer(shapely.points(centres), rng.uniform(100, 800, 30)), crs=3857)
+    return points, lines, areas
+
+
+def test_square_grid_matches_nested_loop_order(layers):
+    points = layers[0]
+    grid = create_grid(points)
+    baseline = nested_loop_grid(points)
+    assert len(grid) == len(baseline)
+    np.testing.assert_allclose(grid.geometry.bounds.to_numpy(), baseline.geometry.bounds.to_numpy())
+    np.testing.assert_array_equal(grid.index, np.arange(len(grid)))
+
+
+@pytest.mark.parametrize('shape', ['square', 'hex'])
+def test_grid_covers_bounds_and_locate_matches_geometries(shape):
+    grid = Grid.from_bounds(BOUNDS, 400, shape)
+    cells = grid.to_geodataframe()
+    assert shapely.box(*BOUNDS).within(cells.geometry.union_all().buffer(1e-6))
+
+    rng = np.random.default_rng(1)
+    x = rng.uniform(BOUNDS[0] - 500, BOUNDS[2] + 500, 2000)
+    y = rng.uniform(BOUNDS[1] - 500, BOUNDS[3] + 500, 2000)
+    point_idx, cell_idx = cells.sindex.query(shapely.points(x, y), predicate='within')
+    expected = np.full(len(x), -1)
+    expected[point_idx] = cells.index.to_numpy()[cell_idx]
+    np.testing.assert_array_equal(grid.locate(x, y), expected)
+
+
+def test_aggregate_layer_matches_per_cell_scan(layers):
+    points, lines, areas = layers
+    grid = create_grid(points, cell_size=1000)
+
+    counts = aggregate_layer(grid, points, 'count', column='shop_count')
+    lengths = aggregate_layer(grid, lines, 'length', column='road_length')
+    area = aggregate_layer(grid, areas, 'area', by='landuse')
+
+    # 原脚本的逐网格统计（线长度和面积都裁剪到网格内）
+    expected_counts = grid.geometry.apply(lambda cell: points[points.intersects(cell)].shape[0])
+    expected_lengths = grid.geometry.apply(lambda cell: lines[lines.intersects(cell)].intersection(cell).length.sum())
+    np.testing.assert_array_equal(counts['shop_count'], expected_counts)
+    np.testing.assert_allclose(lengths['road_length'], expected_lengths)
+    assert sorted(area.columns) == ['residential_area', 'retail_area']
+    for landuse in ('residential', 'retail'):
+        layer = areas[areas['landuse'] == landuse]
+        expected = grid.geometry.apply(lambda cell: layer[layer.intersects(cell)].intersection(cell).area.sum())
+        np.testing.assert_allclose(area[f'{landuse}_area'], expected)
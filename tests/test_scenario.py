@@ -0,0 +1,175 @@
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+import scenario
+from grid import Grid
+from grid_io import save_grid
+
+# 3 x 3 网格（1 km），位于旧金山
+XMIN, YMIN, CELL = -13630000.0, 4545000.0, 1000.0
+
+
+class RecordingEngine:
+    """Stands in for ScenarioEngine: records the edits main() passes on."""
+
+    instances = []
+
+    def __init__(self, city, model, model_dir, grid_path):
+        self.city = city
+        self.edits = None
+        RecordingEngine.instances.append(self)
+
+    def apply(self, edits, commit=False):
+        self.edits = edits
+        return gpd.GeoDataFrame({'cell': [0], 'start_delta': [1.0], 'end_delta': [-1.0]},
+                                geometry=[shapely.box(0, 0, 1, 1)], crs=4326)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    RecordingEngine.instances.clear()
+    monkeypatch.setattr(scenario, 'ScenarioEngine', RecordingEngine)
+    return RecordingEngine.instances
+
+
+def test_main_parses_negative_longitude(engine):
+    scenario.main(['SanFrancisco', '--edit', 'add:station:-122.42,37.77',
+                   '--edit', 'add:bike_lane:-122.42,37.77 -122.41,37.78'])
+    assert engine[0].city == 'SanFrancisco'
+    assert engine[0].edits == [
+        {'action': 'add', 'kind': 'station', 'geometry': (-122.42, 37.77)},
+        {'action': 'add', 'kind': 'bike_lane', 'geometry': [(-122.42, 37.77), (-122.41, 37.78)]},
+    ]
+
+
+@pytest.mark.parametrize('edit', ['add station -122.42,37.77', 'add:station:', 'add:station:-122.42'])
+def test_main_rejects_malformed_edit(engine, edit):
+    with pytest.raises(SystemExit):
+        scenario.main(['SanFrancisco', '--edit', edit])
+    assert engine == []
+
+
+class StubScorer:
+    """Linear stand-in for DemandScorer, so predictions follow from the features."""
+
+    targets = ['start_count', 'end_count']
+
+    def __init__(self, model_dir, name):
+        self.calls = []
+
+    def predict(self, features):
+        self.calls.append(len(features))
+        start = (10 * features['railway_station_count'] + 2 * features['bus_station_count']
+                 + 0.01 * features['bicycle_lane_length'])
+        return pd.DataFrame({'start_count': start, 'end_count': 2 * start}, index=features.index)
+
+
+def to_lonlat(*xy):
+    """WGS84 (lon, lat) pairs of metric points."""
+    points = gpd.GeoSeries(gpd.points_from_xy(*np.array(xy).T), crs=scenario.METRIC_CRS).to_crs(4326)
+    return [(p.x, p.y) for p in points]
+
+
+def cell_of(row, col):
+    return col * 3 + row
+
+
+@pytest.fixture
+def grid_engine(tmp_path, monkeypatch):
+    grid = Grid(XMIN, YMIN, CELL, 3, 3)
+    cells = grid.to_geodataframe()
+    cells['railway_station_count'] = np.zeros(9, dtype=np.int64)
+    cells.loc[[cell_of(0, 1), cell_of(2, 2)], 'railway_station_count'] = [2, 1]
+    cells['bus_station_count'] = np.arange(9, dtype=np.int64)
+    cells['bicycle_lane_length'] = np.zeros(9)
+    cells.loc[cell_of(1, 1), 'bicycle_lane_length'] = 300.0
+    save_grid(cells, tmp_path / 'grid_with_counts', grid, formats=('parquet',))
+    monkeypatch.setattr(scenario, 'DemandScorer', StubScorer)
+    return scenario.ScenarioEngine('SanFrancisco', grid_path=str(tmp_path / 'grid_with_counts'))
+
+
+def test_add_station_increments_one_cell(grid_engine):
+    [point] = to_lonlat((XMIN + 1500, YMIN + 1500))
+    delta = grid_engine.apply([{'action': 'add', 'kind': 'station', 'geometry': point}])
+
+    assert delta['cell'].tolist() == [cell_of(1, 1)]
+    assert delta['railway_station_count_before'].tolist() == [0]
+    assert delta['railway_station_count_after'].tolist() == [1]
+    assert delta['railway_station_count_after'].dtype == np.int64
+    assert delta['start_count_before'].tolist() == pytest.approx([11])
+    assert delta['start_count_after'].tolist() == pytest.approx([21])
+    assert delta['start_delta'].tolist() == pytest.approx([10])
+    assert delta['end_delta'].tolist() == pytest.approx([20])
+    # 编辑前后一起预测一次
+    assert grid_engine.scorer.calls == [2]
+    assert delta.crs.to_epsg() == 4326
+    assert delta.geometry.iloc[0].contains(shapely.Point(point))
+
+
+def test_bike_lane_changes_clipped_length(grid_engine):
+    line = to_lonlat((XMIN + 500, YMIN + 1500), (XMIN + 2600, YMIN + 1500))
+    cells, changes = grid_engine.feature_changes([{'action': 'add', 'kind': 'bike_lane', 'geometry': line}])
+    assert sorted(cells) == [cell_of(1, 0), cell_of(1, 1), cell_of(1, 2)]
+    lengths = dict(zip(cells, changes['bicycle_lane_length']))
+    assert lengths == pytest.approx({cell_of(1, 0): 500, cell_of(1, 1): 1000, cell_of(1, 2): 600})
+
+    cells, changes = grid_engine.feature_changes([{'action': 'remove', 'kind': 'bike_lane', 'geometry': line}])
+    assert dict(zip(cells, changes['bicycle_lane_length'])) == pytest.approx(
+        {cell_of(1, 0): -500, cell_of(1, 1): -1000, cell_of(1, 2): -600})
+
+
+def test_removals_are_clamped_at_zero(grid_engine):
+    line = to_lonlat((XMIN + 500, YMIN + 1500), (XMIN + 1500, YMIN + 1500))
+    delta = grid_engine.apply([
+        {'action': 'remove', 'kind': 'station', 'geometry': to_lonlat((XMIN + 500, YMIN + 500))[0]},
+        {'action': 'remove', 'kind': 'station', 'geometry': to_lonlat((XMIN + 1500, YMIN + 500))[0]},
+        {'action': 'remove', 'kind': 'bike_lane', 'geometry': line},
+    ]).set_index('cell')
+
+    # 第 0 行第 0 列没有站点，第 0 行第 1 列有两个
+    assert delta.loc[cell_of(0, 0), 'railway_station_count_after'] == 0
+    assert delta.loc[cell_of(0, 1), 'railway_station_count_after'] == 1
+    assert delta.loc[cell_of(0, 1), 'start_delta'] == pytest.approx(-10)
+    # 第 1 行第 0 列没有车道，第 1 行第 1 列只有 300 m，各移除 500 m
+    assert delta.loc[cell_of(1, 0), 'bicycle_lane_length_after'] == pytest.approx(0)
+    assert delta.loc[cell_of(1, 1), 'bicycle_lane_length_after'] == pytest.approx(0)
+    assert delta.loc[cell_of(1, 1), 'start_delta'] == pytest.approx(-3)
+    assert delta.loc[cell_of(0, 0), 'start_delta'] == pytest.approx(0)
+
+
+def test_edits_in_one_cell_add_up_and_commit(grid_engine):
+    point = to_lonlat((XMIN + 2500, YMIN + 2500))[0]
+    edits = [{'action': 'add', 'kind': 'station', 'geometry': point},
+             {'action': 'add', 'kind': 'bus_stop', 'geometry': point},
+             {'action': 'add', 'kind': 'station', 'geometry': point}]
+    delta = grid_engine.apply(edits)
+    assert delta['railway_station_count_after'].tolist() == [3]
+    assert delta['bus_station_count_after'].tolist() == [9]
+    assert delta['start_delta'].tolist() == pytest.approx([22])
+    # 未提交的编辑不改变引擎中的特征
+    assert grid_engine.features.loc[cell_of(2, 2), 'railway_station_count'] == 1
+
+    grid_engine.apply(edits[:1], commit=True)
+    assert grid_engine.features.loc[cell_of(2, 2), 'railway_station_count'] == 2
+    delta = grid_engine.apply(edits[:1])
+    assert delta['railway_station_count_before'].tolist() == [2]
+
+
+def test_edit_outside_grid_changes_nothing(grid_engine):
+    point = to_lonlat((XMIN - 5000, YMIN - 5000))[0]
+    delta = grid_engine.apply([{'action': 'add', 'kind': 'station', 'geometry': point}])
+    assert len(delta) == 0
+    assert grid_engine.scorer.calls == []
+
+
+def test_unknown_edit_kind_is_rejected(grid_engine):
+    with pytest.raises(ValueError, match='Unknown edit kind'):
+        grid_engine.apply([{'action': 'add', 'kind': 'tram', 'geometry': (-122.42, 37.77)}])
@@ -0,0 +1,76 @@
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+from coords import project
+from od_store import write_store
+from station_index import StationIndex, _exact_radius, build_index
+from station_ratio import station_counts, within_counts
+
+CRS = 3857
+RADII = [150, 400, 1000]
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = np.random.default_rng(0)
+    station_lon = rng.uniform(121.44, 121.50, 10)
+    station_lat = rng.uniform(31.20, 31.25, 10)
+    n = 3000
+    trips = {
+        'start_lng': rng.uniform(121.43, 121.51, n), 'start_lat': rng.uniform(31.19, 31.26, n),
+        'end_lng': rng.uniform(121.43, 121.51, n), 'end_lat': rng.uniform(31.19, 31.26, n),
+    }
+    trips['end_lng'][:40] = np.nan
+    station_xy = project(station_lon, station_lat, CRS)
+    columns = build_index(trips, station_xy, CRS, radius_m=max(RADII))
+    write_store(tmp_path / 'index', columns,
+                meta={'n_stations': len(station_xy), 'exact_radius': _exact_radius(columns, len(station_xy))})
+    return StationIndex(tmp_path / 'index'), trips, station_xy
+
+
+def brute_force_distances(trips, station_xy):
+    """(station, distance) of every start and end point to all stations, inf for missing points."""
+    points = np.concatenate([project(trips[f'{endpoint}_lng'], trips[f'{endpoint}_lat'], CRS)
+                             for endpoint in ('start', 'end')])
+    distance = np.linalg.norm(points[:, None, :] - station_xy[None, :, :], axis=2)
+    distance[np.isnan(distance)] = np.inf
+    return distance.argmin(axis=1), distance.min(axis=1)
+
+
+def test_within_counts_match_station_buffers(index):
+    index, trips, station_xy = index
+    _, distance = index.nearest()
+    _, expected = brute_force_distances(trips, station_xy)
+    np.testing.assert_allclose(distance, expected, rtol=1e-6)
+
+    counts = within_counts(np.sort(distance), RADII)
+    # 原脚本：OD 点落在所有地铁站缓冲区的并集内；缓冲区是多边形，只比较不在边界附近的点
+    points = gpd.GeoSeries(gpd.points_from_xy(np.concatenate([trips['start_lng'], trips['end_lng']]),
+                                              np.concatenate([trips['start_lat'], trips['end_lat']])),
+                           crs=4326).to_crs(CRS)
+    stations = gpd.GeoSeries(gpd.points_from_xy(station_xy[:, 0], station_xy[:, 1]), crs=CRS)
+    for radius, count in zip(RADII, counts):
+        within = points.within(stations.buffer(radius).union_all()).to_numpy()
+        clear = np.abs(expected - radius) > 5
+        assert count == (expected <= radius).sum()
+        np.testing.assert_array_equal(within[clear], (expected <= radius)[clear])
+
+
+def test_station_counts_split_by_nearest_station(index):
+    index, trips, station_xy = index
+    nearest, distance = index.nearest()
+    radii = [1000, 150, 400]
+    counts = station_counts(distance, nearest, radii, index.n_stations)
+
+    expected_station, expected = brute_force_distances(trips, station_xy)
+    for j, radius in enumerate(radii):
+        within = expected <= radius
+        np.testing.assert_array_equal(counts[:, j], np.bincount(expected_station[within],
+                                                                minlength=index.n_stations))
+    np.testing.assert_array_equal(counts.sum(axis=0), within_counts(np.sort(distance), radii))